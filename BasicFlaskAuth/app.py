@@ -1,5 +1,7 @@
 from flask import Flask, request, abort
 import json
+import threading
+import time
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
@@ -10,6 +12,12 @@ app = Flask(__name__)
 AUTH0_DOMAIN = @TODO_REPLACE_WITH_YOUR_DOMAIN
 ALGORITHMS = ['RS256']
 API_AUDIENCE = @TODO_REPLACE_WITH_YOUR_API_AUDIENCE
+JWKS_TTL = 600
+JWKS_MIN_REFRESH_INTERVAL = 30
+JWKS_FETCH_TIMEOUT = 5
+
+_jwks = {'keys': {}, 'fetched_at': 0, 'attempted_at': 0}
+_jwks_lock = threading.Lock()
 
 
 class AuthError(Exception):
@@ -51,26 +59,62 @@ def get_token_auth_header():
     return token
 
 
-def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+def get_signing_key(kid):
+    """Returns the JWKS key for kid, fetching the key set only when the
+    cached copy is older than JWKS_TTL or does not know kid (rotation).
+    One request fetches at a time; the others keep using the cached keys
+    meanwhile and only wait when there are none yet. A failed fetch keeps
+    the cached keys too, and is not retried for JWKS_MIN_REFRESH_INTERVAL.
+    """
+    keys = _jwks['keys']
+    if not jwks_refresh_due(kid):
+        return keys.get(kid)
+    if not _jwks_lock.acquire(blocking=not keys):
+        return keys.get(kid)
+    try:
+        # the fetch we may have waited for could have done it already
+        if jwks_refresh_due(kid):
+            _jwks['attempted_at'] = time.time()
+            try:
+                _jwks['keys'] = fetch_signing_keys()
+                _jwks['fetched_at'] = time.time()
+            except Exception:
+                if not _jwks['keys']:
+                    raise
+    finally:
+        _jwks_lock.release()
+    return _jwks['keys'].get(kid)
+
+
+def jwks_refresh_due(kid):
+    now = time.time()
+    if now - _jwks['attempted_at'] < JWKS_MIN_REFRESH_INTERVAL:
+        return False
+    return now - _jwks['fetched_at'] > JWKS_TTL or kid not in _jwks['keys']
+
+
+def fetch_signing_keys():
+    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json',
+                      timeout=JWKS_FETCH_TIMEOUT)
     jwks = json.loads(jsonurl.read())
+    return {key['kid']: {
+        'kty': key['kty'],
+        'kid': key['kid'],
+        'use': key['use'],
+        'n': key['n'],
+        'e': key['e']
+    } for key in jwks['keys']}
+
+
+def verify_decode_jwt(token):
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = get_signing_key(unverified_header['kid'])
     if rsa_key:
         try:
             payload = jwt.decode(
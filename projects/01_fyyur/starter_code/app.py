@@ -4,8 +4,9 @@
 
 import json
 import dateutil.parser
+from datetime import datetime, timedelta
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, stream_with_context, Markup
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 import logging
@@ -14,7 +15,16 @@ from flask_wtf import FlaskForm
 from forms import *
 from sqlalchemy.exc import SQLAlchemyError
 from flask_migrate import Migrate
+from flask.cli import AppGroup
+from search import create_search_backend
+from genres import MATCHES, create_genre_backend
+from cache import create_fragment_cache
+from importer import ImportTarget, create_import_command
+from metrics import Metrics
 import sys 
+import click
+from functools import lru_cache
+from itertools import groupby
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -27,17 +37,134 @@ db = SQLAlchemy(app)
 
 # TODO: connect to a local postgresql database
 migrate = Migrate(app, db)
+search_backend = create_search_backend(app, db)
+genre_backend = create_genre_backend(app, db)
+fragment_cache = create_fragment_cache(app, db)
+metrics = Metrics(app)
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
-class Venue(db.Model):
+class BulkMixin(object):
+    # bulk_insert(rows), bulk_update(mapping) and bulk_delete(ids) write many
+    # rows at once: one multi-row statement (or executemany) per chunk of
+    # BULK_CHUNK_SIZE rows and one transaction per chunk, instead of a commit
+    # per row. Caches that depend on a table subscribe with on_bulk_change().
+    # The same mixin is kept in trivia's backend/models.py and the coffee
+    # shop's backend/src/database/models.py: change all three together.
+    BULK_CHUNK_SIZE = 1000
+
+    @classmethod
+    def bulk_insert(cls, rows):
+      table = cls.__table__
+      count = 0
+      for chunk in chunked(rows, cls.BULK_CHUNK_SIZE):
+        if db.engine.dialect.name == 'postgresql':
+          statement, params = table.insert().values(chunk), None
+        else:
+          # sqlite limits the number of bound parameters per statement
+          statement, params = table.insert(), chunk
+        cls._bulk_commit(lambda: cls.bulk_chunk(
+          'insert', chunk, lambda: db.session.execute(statement, params)))
+        count += len(chunk)
+      cls.after_bulk_change()
+      return count
+
+    @classmethod
+    def bulk_update(cls, mapping):
+      # mapping is {id: {column: new value}}
+      rows = [dict(values, id=row_id) for row_id, values in mapping.items()]
+      for chunk in chunked(rows, cls.BULK_CHUNK_SIZE):
+        cls._bulk_commit(lambda: cls.bulk_chunk(
+          'update', chunk, lambda: db.session.bulk_update_mappings(cls, chunk)))
+      cls.after_bulk_change()
+      return len(rows)
+
+    @classmethod
+    def bulk_delete(cls, ids):
+      # rows reached through delete-cascading relationships (a venue's
+      # shows) go in the same transaction as their parents
+      count = 0
+      for chunk in chunked(ids, cls.BULK_CHUNK_SIZE):
+        count += cls._bulk_commit(lambda: cls._bulk_delete_chunk(chunk))
+      cls._after_bulk_delete()
+      return count
+
+    @classmethod
+    def bulk_chunk(cls, kind, chunk, write):
+      # runs write() for one chunk of an 'insert' or 'update' (row dicts) or
+      # a 'delete' (ids), inside the chunk's transaction. Models keeping
+      # data derived from their rows elsewhere override it to update that
+      # data in the same transaction.
+      return write()
+
+    @classmethod
+    def on_bulk_change(cls, listener):
+      cls._bulk_listeners = cls.__dict__.get('_bulk_listeners', []) + [listener]
+
+    @classmethod
+    def after_bulk_change(cls):
+      for listener in cls.__dict__.get('_bulk_listeners', []):
+        listener()
+
+    @classmethod
+    def _bulk_cascades(cls):
+      # (child model, foreign key column) of every relationship that
+      # cascades deletes; query deletes skip the ORM cascade
+      cascades = []
+      for relationship in db.inspect(cls).relationships:
+        if relationship.cascade.delete:
+          (_, foreign_key), = relationship.local_remote_pairs
+          cascades.append((relationship.mapper.class_, foreign_key))
+      return cascades
+
+    @classmethod
+    def _bulk_delete_chunk(cls, ids):
+      for child, foreign_key in cls._bulk_cascades():
+        child_ids = [row[0] for row in
+          db.session.query(child.id).filter(foreign_key.in_(ids))]
+        for child_chunk in chunked(child_ids, child.BULK_CHUNK_SIZE):
+          child._bulk_delete_chunk(child_chunk)
+      return cls.bulk_chunk('delete', ids, lambda: cls.query.filter(
+        cls.id.in_(ids)).delete(synchronize_session=False))
+
+    @classmethod
+    def _after_bulk_delete(cls):
+      for child, _ in cls._bulk_cascades():
+        child._after_bulk_delete()
+      cls.after_bulk_change()
+
+    @staticmethod
+    def _bulk_commit(write):
+      try:
+        result = write()
+        db.session.commit()
+        return result
+      except Exception:
+        db.session.rollback()
+        raise
+
+def chunked(rows, size):
+  chunk = []
+  for row in rows:
+    chunk.append(row)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+class Venue(BulkMixin, db.Model):
     __tablename__ = 'venue'
+    __table_args__ = (
+      db.Index('ix_venue_city_state', 'city', 'state'),
+      db.Index('ix_venue_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
-    genres = db.Column(db.ARRAY(db.String()))
+    genres = db.Column(db.ARRAY(db.String()).with_variant(db.JSON(), 'sqlite'))
     address = db.Column(db.String(120))
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))  
@@ -47,7 +174,15 @@ class Venue(db.Model):
     image_link = db.Column(db.String(500))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500), default='')
-    shows = db.relationship('show', backref='venue', lazy=True)
+    # shows starting after shows_counted_at count as upcoming, see
+    # Show counters below
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0,
+      server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0,
+      server_default='0')
+    shows_counted_at = db.Column(db.DateTime(), default=datetime.now)
+    shows = db.relationship('Show', backref='Venue', lazy=True,
+      cascade='all, delete')
 
     def __init__(self, name, genres, address, city, state, phone, 
       website, facebook_link, image_link, seeking_talent = False, 
@@ -108,12 +243,15 @@ class Venue(db.Model):
       
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
-class Artist(db.Model):
+class Artist(BulkMixin, db.Model):
     __tablename__ = 'artist'
+    __table_args__ = (
+      db.Index('ix_artist_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
-    genres = db.Column(db.ARRAY(db.String()))
+    genres = db.Column(db.ARRAY(db.String()).with_variant(db.JSON(), 'sqlite'))
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
@@ -122,7 +260,15 @@ class Artist(db.Model):
     seeking_venue = db.Column(db.Boolean, default= False)
     seeking_description = db.Column(db.String(500), default='')
     image_link = db.Column(db.String(500))
-    shows = db.relationship('show', backref='artist', lazy=True)
+    # shows starting after shows_counted_at count as upcoming, see
+    # Show counters below
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0,
+      server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0,
+      server_default='0')
+    shows_counted_at = db.Column(db.DateTime(), default=datetime.now)
+    shows = db.relationship('Show', backref='Artist', lazy=True,
+      cascade='all, delete')
 
     def __init__(self, name, genres, city, state, phone, 
       website, facebook_link, image_link, seeking_venue=False, 
@@ -179,15 +325,20 @@ class Artist(db.Model):
         'image_link': self.image_link,
         }
 
-class Show(db.Model):
+class Show(BulkMixin, db.Model):
     __tablename__ = 'show'
+    # the /shows listing walks shows in (start_time, id) order, venue and
+    # artist pages and the upcoming counts look shows up per venue/artist
+    __table_args__ = (
+      db.Index('ix_show_start_time_id', 'start_time', 'id'),
+      db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+      db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+    )
        
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime())
     artist_id = db.Column(db.Integer, db.ForeignKey('artist.id'), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey('venue.id'), nullable=False)
-    artist = db.relationship('artist', backref=db.backref('shows', cascade='all, delete'))
-    venue = db.relationship('venue', backref=db.backref('shows', cascade='all, delete'))
 
     def __init__(self, venue_id, artist_id, start_time):
       self.venue_id = venue_id
@@ -205,6 +356,26 @@ class Show(db.Model):
       db.session.delete(self)
       db.session.commit()
 
+    @classmethod
+    def bulk_chunk(cls, kind, chunk, write):
+      # bulk writes skip the mapper events that keep the show counts: the
+      # venues and artists of the chunk's shows, before and after the
+      # write, are recounted in the chunk's transaction instead
+      venue_ids, artist_ids = set(), set()
+      if kind in ('update', 'delete'):
+        ids = [row['id'] for row in chunk] if kind == 'update' else chunk
+        for venue_id, artist_id in db.session.query(
+            cls.venue_id, cls.artist_id).filter(cls.id.in_(ids)):
+          venue_ids.add(venue_id)
+          artist_ids.add(artist_id)
+      result = write()
+      if kind in ('insert', 'update'):
+        for row in chunk:
+          venue_ids.add(row.get('venue_id'))
+          artist_ids.add(row.get('artist_id'))
+      recount_shows(venue_ids - {None}, artist_ids - {None})
+      return result
+
     def details(self):
       return{
         'venue_id' :self.venue_id,
@@ -217,7 +388,7 @@ class Show(db.Model):
 
     def artist_details(self):
         return{
-            'artist_id' :self.venue_id,
+            'artist_id' :self.artist_id,
             'artist_name' :self.Artist.name,
             'artist_image_link' :self.Artist.image_link,
             'start_time' :self.start_time
@@ -234,14 +405,348 @@ class Show(db.Model):
 
 # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
+#  Show counters
+#  ----------------------------------------------------------------
+# venue and artist rows carry their upcoming and past show counts as of
+# shows_counted_at, so listings read one row instead of counting shows.
+# Every show insert, delete or move adjusts both counts in the same flush;
+# rollover_shows() moves shows that have started since into the past. Rows
+# written by COPY have no shows_counted_at: all their shows count as
+# upcoming until the next rollover.
+
+NEVER_COUNTED = datetime(1970, 1, 1)
+
+def counted_at(table):
+  return db.func.coalesce(table.c.shows_counted_at, NEVER_COUNTED)
+
+def adjust_show_counts(connection, venue_id, artist_id, start_time, step):
+  if isinstance(start_time, str):
+    start_time = dateutil.parser.parse(start_time)
+  for model, parent_id in ((Venue, venue_id), (Artist, artist_id)):
+    table = model.__table__
+    if start_time is None:
+      upcoming = db.false()
+    else:
+      upcoming = counted_at(table) < start_time
+    connection.execute(table.update().where(table.c.id == parent_id).values(
+      upcoming_shows_count=table.c.upcoming_shows_count
+        + db.case([(upcoming, step)], else_=0),
+      past_shows_count=table.c.past_shows_count
+        + db.case([(upcoming, 0)], else_=step)))
+
+@db.event.listens_for(Show, 'after_insert')
+def count_inserted_show(mapper, connection, show):
+  adjust_show_counts(connection, show.venue_id, show.artist_id,
+    show.start_time, 1)
+
+@db.event.listens_for(Show, 'after_delete')
+def count_deleted_show(mapper, connection, show):
+  adjust_show_counts(connection, show.venue_id, show.artist_id,
+    show.start_time, -1)
+
+@db.event.listens_for(Show, 'after_update')
+def count_moved_show(mapper, connection, show):
+  state = db.inspect(show)
+  old = {}
+  for key in ('venue_id', 'artist_id', 'start_time'):
+    history = state.attrs[key].history
+    if history.has_changes() and history.deleted:
+      old[key] = history.deleted[0]
+  if old:
+    adjust_show_counts(connection, old.get('venue_id', show.venue_id),
+      old.get('artist_id', show.artist_id),
+      old.get('start_time', show.start_time), -1)
+    count_inserted_show(mapper, connection, show)
+
+def recount_shows(venue_ids=None, artist_ids=None, now=None):
+  # recounts the shows of the given venues and artists (all of them when
+  # None) from the show table as of now: one UPDATE per table and chunk of
+  # ids, in the caller's transaction
+  now = now or datetime.now()
+  changed = 0
+  for model, key, ids in ((Venue, Show.venue_id, venue_ids),
+      (Artist, Show.artist_id, artist_ids)):
+    table = model.__table__
+    shows = db.select([db.func.count(Show.id)]).where(key == table.c.id)
+    update = table.update().values(
+      upcoming_shows_count=shows.where(Show.start_time > now).as_scalar(),
+      past_shows_count=shows.where(
+        db.or_(Show.start_time <= now, Show.start_time.is_(None))
+      ).as_scalar(),
+      shows_counted_at=now)
+    if ids is None:
+      changed += db.session.execute(update).rowcount
+      continue
+    for chunk in chunked(sorted(ids), BulkMixin.BULK_CHUNK_SIZE):
+      changed += db.session.execute(
+        update.where(table.c.id.in_(chunk))).rowcount
+  return changed
+
+def rollover_shows(now=None, full=False):
+  # one UPDATE per table. Only rows with shows that started between their
+  # shows_counted_at and now are touched, each moving that many shows from
+  # upcoming to past. full=True recounts every row from the show table.
+  now = now or datetime.now()
+  if full:
+    changed = recount_shows(now=now)
+  else:
+    changed = 0
+    for model, key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+      table = model.__table__
+      started = db.select([db.func.count(Show.id)]).where(
+        key == table.c.id).where(Show.start_time > counted_at(table)).where(
+        Show.start_time <= now)
+      moved = started.as_scalar()
+      update = table.update().where(db.exists(
+        started.with_only_columns([Show.id]))).values(
+          upcoming_shows_count=table.c.upcoming_shows_count - moved,
+          past_shows_count=table.c.past_shows_count + moved,
+          shows_counted_at=now)
+      changed += db.session.execute(update).rowcount
+  db.session.commit()
+  # moved shows change sides on the venue and artist pages
+  fragment_cache.bump(Venue.__tablename__, Artist.__tablename__)
+  return changed
+
+search_backend.register(Venue.name)
+search_backend.register(Artist.name)
+genre_backend.register(Venue.genres)
+genre_backend.register(Artist.genres)
+for model in (Venue, Artist, Show):
+  fragment_cache.watch_bulk(model)
+
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def venue_areas(genres=None, match='all'):
+  # one round trip for the whole listing, reading the upcoming show count
+  # kept on each venue row. genres limits it to venues listing all (or,
+  # with match='any', any) of them.
+  query = db.session.query(
+      Venue.id, Venue.name, Venue.city, Venue.state,
+      Venue.upcoming_shows_count)
+  if genres:
+    query = query.filter(genre_backend.filter(Venue.genres, genres, match))
+  rows = query.order_by(Venue.city, Venue.state, Venue.name, Venue.id).all()
+
+  areas = []
+  for (city, state), venues in groupby(rows, key=lambda row: (row[2], row[3])):
+    areas.append({
+      'city': city,
+      'state': state,
+      'venues': [{
+        'id': venue_id,
+        'name': name,
+        'num_upcoming_shows': num_upcoming_shows,
+      } for venue_id, name, _, _, num_upcoming_shows in venues]
+    })
+  return areas
+
+def artist_listing(genres=None, match='all'):
+  # id and name of every artist, or of those listing all (or any) of genres
+  query = db.session.query(Artist.id, Artist.name)
+  if genres:
+    query = query.filter(genre_backend.filter(Artist.genres, genres, match))
+  return [{'id': artist_id, 'name': name}
+    for artist_id, name in query.order_by(Artist.name, Artist.id)]
+
+# the genres the listing filters offer, the ones the forms accept
+GENRES = [genre for genre, _ in VenueForm.genres.kwargs['choices']]
+
+def genre_filter_args():
+  # ?genre=Jazz&genre=Folk (repeatable) and ?match=all|any from the query
+  # string. Genres the forms do not offer are dropped, so the pages'
+  # cache keys only ever hold known genres.
+  requested = set(request.args.getlist('genre'))
+  genres = [genre for genre in GENRES if genre in requested]
+  match = request.args.get('match') or 'all'
+  if match not in MATCHES:
+    abort(400)
+  return genres, match
+
+def search_artist_page(search_term, after_id=None, limit=None):
+  # id, name and upcoming show count for one page of matches in a single
+  # statement. Pages are keyed on artist id, so deep pages cost the same as
+  # the first one and no Show rows are ever loaded. count is the number of
+  # matches on all pages, from a COUNT over the same indexed filter.
+  limit = limit or app.config['SEARCH_RESULTS_PER_PAGE']
+  matches = search_backend.filter(Artist.name, search_term)
+  count = db.session.query(db.func.count(Artist.id)).filter(matches).scalar()
+  query = db.session.query(
+      Artist.id, Artist.name, Artist.upcoming_shows_count).filter(matches)
+  if after_id is not None:
+    query = query.filter(Artist.id > after_id)
+  rows = query.order_by(Artist.id).limit(limit + 1).all()
+
+  data = [{
+    'id': artist_id,
+    'name': name,
+    'num_upcoming_shows': num_upcoming_shows,
+  } for artist_id, name, num_upcoming_shows in rows[:limit]]
+  return {
+    'count': count,
+    'data': data,
+    'next_after_id': data[-1]['id'] if len(rows) > limit else None,
+  }
+
+def ndjson_lines(rows, format):
+  # rows come through a server-side cursor EXPORT_BATCH_SIZE at a time, so
+  # an export holds one batch in memory however many rows it sends.
+  rows = rows.execution_options(stream_results=True).yield_per(
+    app.config['EXPORT_BATCH_SIZE'])
+  for row in rows:
+    yield json.dumps(format(row)) + '\n'
+
+def export_response(rows, format):
+  return Response(stream_with_context(ndjson_lines(rows, format)),
+    mimetype='application/x-ndjson')
+
+def show_export_row(row):
+  show_id, venue_id, venue_name, artist_id, artist_name, start_time = row
+  return {
+    'id': show_id,
+    'venue_id': venue_id,
+    'venue_name': venue_name,
+    'artist_id': artist_id,
+    'artist_name': artist_name,
+    'start_time': start_time.isoformat() if start_time else None,
+  }
+
+def partition_shows(shows, now=None):
+  # splits shows into (past, upcoming) in one pass, each in start order.
+  # Shows without a start time count as past, as recount_shows counts
+  # them, and come first.
+  now = now or datetime.now()
+  past, upcoming = [], []
+  for show in sorted(shows, key=lambda show: (
+      show.start_time is not None, show.start_time or now)):
+    if show.start_time is not None and show.start_time > now:
+      upcoming.append(show)
+    else:
+      past.append(show)
+  return past, upcoming
+
+def venue_page(venue_id):
+  # the venue, its shows and each show's artist in two statements: the
+  # venue, then its shows joined to their artists (selectinload). Returns
+  # None when there is no such venue.
+  venue = Venue.query.options(
+    db.selectinload(Venue.shows).joinedload(Show.Artist)).get(venue_id)
+  if venue is None:
+    return None
+  past, upcoming = partition_shows(venue.shows)
+  data = venue.details()
+  data['past_shows'] = [show.artist_details() for show in past]
+  data['upcoming_shows'] = [show.artist_details() for show in upcoming]
+  data['past_shows_count'] = len(past)
+  data['upcoming_shows_count'] = len(upcoming)
+  return data
+
+def artist_page(artist_id):
+  # same as venue_page, from the artist side
+  artist = Artist.query.options(
+    db.selectinload(Artist.shows).joinedload(Show.Venue)).get(artist_id)
+  if artist is None:
+    return None
+  past, upcoming = partition_shows(artist.shows)
+  data = artist.details()
+  data['past_shows'] = [show.venue_details() for show in past]
+  data['upcoming_shows'] = [show.venue_details() for show in upcoming]
+  data['past_shows_count'] = len(past)
+  data['upcoming_shows_count'] = len(upcoming)
+  return data
+
+def show_listing(start=None, end=None, after=None, page=1, limit=None):
+  # one page of shows in (start_time, id) order with only the columns
+  # shows.html uses, read in one statement along ix_show_start_time_id.
+  # Pages are picked by `after`, the (start_time, id) of the last show
+  # already seen, or by page number for direct jumps. Shows without a start
+  # time have no place in the schedule (nor a cursor) and are left out.
+  limit = limit or app.config['SHOWS_PER_PAGE']
+  query = db.session.query(
+      Show.id, Show.start_time, Show.venue_id, Venue.name, Show.artist_id,
+      Artist.name, Artist.image_link
+    ).join(Venue, Venue.id == Show.venue_id
+    ).join(Artist, Artist.id == Show.artist_id
+    ).filter(Show.start_time.isnot(None)
+    ).order_by(Show.start_time, Show.id)
+  if start is not None:
+    query = query.filter(Show.start_time >= start)
+  if end is not None:
+    query = query.filter(Show.start_time < end)
+  if after is not None:
+    query = query.filter(db.tuple_(Show.start_time, Show.id) > after)
+  else:
+    query = query.offset((page - 1) * limit)
+  rows = query.limit(limit + 1).all()
+
+  shows = [{
+    'venue_id': venue_id,
+    'venue_name': venue_name,
+    'artist_id': artist_id,
+    'artist_name': artist_name,
+    'artist_image_link': artist_image_link,
+    'start_time': start_time,
+  } for (_, start_time, venue_id, venue_name, artist_id, artist_name,
+         artist_image_link) in rows[:limit]]
+  next_after = None
+  if len(rows) > limit:
+    next_after = encode_show_cursor(rows[limit - 1][1], rows[limit - 1][0])
+  return shows, next_after
+
+def render_cached_page(page, fragment, key, tables, data):
+  # page with its content fragment rendered from data() once per key and
+  # version of tables: hits skip both data()'s queries and the fragment's
+  # render. The layout around it holds the flashed messages and is
+  # rendered per request. data() returns None when there is no such page.
+  def render():
+    context = data()
+    if context is None:
+      return None
+    return {
+      'title': context.get('title'),
+      'content': render_template(fragment, **context),
+    }
+  parts = fragment_cache.fetch(key, tables, render)
+  if parts is None:
+    return None
+  # entries hold plain strings, the fragment is HTML rendered by us
+  return render_template(page, title=parts['title'],
+    content=Markup(parts['content']))
+
+def encode_show_cursor(start_time, show_id):
+  return '{}_{}'.format(start_time.isoformat(), show_id)
+
+def parse_window_end(value):
+  # `to` comes from a date input: a bare date ends the window after that
+  # whole day rather than at its midnight. Parsing again with another
+  # default hour tells whether the value had a time part.
+  end = dateutil.parser.parse(value)
+  other = dateutil.parser.parse(value, default=datetime(2000, 1, 1, 1))
+  if end.hour != other.hour:
+    end += timedelta(days=1)
+  return end
+
+def decode_show_cursor(cursor):
+  start_time, _, show_id = cursor.rpartition('_')
+  return datetime.fromisoformat(start_time), int(show_id)
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
+# pages format the same few start times over and over
+@lru_cache(maxsize=4096)
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
+  if value is None:
+    return ''
+  if isinstance(value, datetime):
+    date = value
+  else:
+    date = dateutil.parser.parse(value)
   if format == 'full':
       format="EEEE MMMM, d, y 'at' h:mma"
   elif format == 'medium':
@@ -250,6 +755,28 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+fyyur_cli = AppGroup('fyyur', help='Fyyur data commands.')
+fyyur_cli.add_command(create_import_command(db, {
+  'venues': ImportTarget(Venue, VenueForm),
+  'artists': ImportTarget(Artist, ArtistForm),
+  'shows': ImportTarget(Show, ShowForm,
+    references={'artist_id': Artist, 'venue_id': Venue}),
+}))
+
+@fyyur_cli.command('rollover')
+@click.option('--full', is_flag=True,
+  help='Recount every venue and artist from the show table.')
+def rollover_command(full):
+  '''Move shows that have started from the upcoming to the past counts.'''
+  changed = rollover_shows(full=full)
+  click.echo('{} venues and artists updated'.format(changed))
+
+app.cli.add_command(fyyur_cli)
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -288,39 +815,19 @@ def venues():
     }]
   }]'''
 
-  venues = Venue.query.group_by(Venue.id, Venue.state,
-                Venue.city).all()
-  venue_city_state = ''
-  data = []
-  current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-  for venue in venues:
-      upcoming_shows = venue.shows.filter(Show.start_time > current_time).all()
-      if venue_city_state == venue.city + venue.state:
-          data[len(data)-1]['venues'].append({
-            'id': venue.id,
-            'name': venue.name,
-            'num_upcoming_shows': len(upcoming_shows)
-          })
-      else:
-          venue_city_state = venue.city + venue.state
-          data.append({
-             'city': venue.city,
-             'state': venue.state,
-             'venues': [{
-                'id': venue.id,
-                'name': venue.name,
-                'num_upcoming_shows': len(upcoming_shows)
-             }]
-          })
-  return render_template('pages/venues.html', areas=data)
+  genres, match = genre_filter_args()
+  return render_cached_page('pages/venues.html', 'fragments/venues.html',
+    ('venues', tuple(sorted(genres)), match), ('venue',),
+    lambda: {'areas': venue_areas(genres, match), 'genres': GENRES,
+      'selected': genres, 'match': match})
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  search_str = request.form.get('search_term')
-  venue_query = Venue.query.filter(Venue.name.ilike('%{}%'.format(search_str)))
+  search_str = request.form.get('search_term', '')
+  venue_query = Venue.query.filter(search_backend.filter(Venue.name, search_str))
   venue_list = list(map(Venue.short, venue_query))
   response = {
     'count': len(venue_list),
@@ -422,21 +929,17 @@ def show_venue(venue_id):
   }
   """
   
-  venue_query = Venue.query.get(venue_id)
-  if venue_query:
-    venue_details = Venue.details(venue_query)
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    new_shows_query = Show.query.options(db.joinedload(show.venue)).filter(Show.venue_id == venue_id).filter(Show.start_time > current_time).all()
-    new_show = list(map(Show.artist_details, new_shows_query))
-    venue_details["upcoming_shows"] = new_show
-    venue_details["upcoming_shows_count"] = len(new_show)
-    past_shows_query = Show.query.options(db.joinedload(Show.Venue)).filter(Show.venue_id == venue_id).filter(Show.start_time <= current_time).all()
-    past_shows = list(map(Show.artist_details, past_shows_query))
-    venue_details["past_shows"] = past_shows
-    venue_details["past_shows_count"] = len(past_shows)
-
+  def data():
+    venue_details = venue_page(venue_id)
+    if venue_details:
+      return {'venue': venue_details}
+
+  page = render_cached_page('pages/show_venue.html',
+    'fragments/show_venue.html', ('show_venue', venue_id),
+    ('venue', 'show', 'artist'), data)
+  if page:
   #data = list(filter(lambda d: d['id'] == venue_id, [data1, data2, data3]))[0]
-    return render_template('pages/show_venue.html', venue=venue_details)
+    return page
   return render_template('errors/404.html')
 
 #  Create Venue
@@ -512,14 +1015,19 @@ def delete_venue(venue_id):
     db.session.close()
   return None
 
+@app.route('/venues/export')
+def export_venues():
+  # streams every venue as one json object per line (ndjson)
+  return export_response(Venue.query.order_by(Venue.id), Venue.details)
+
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
   # TODO: replace with real data returned from querying the database
   
-  data = db.session.query(Artist).all()
-  
+  genres, match = genre_filter_args()
+
   """
   data=[{
     "id": 4,
@@ -532,7 +1040,10 @@ def artists():
     "name": "The Wild Sax Band",
   }]
   """
-  return render_template('pages/artists.html', artists=data)
+  return render_cached_page('pages/artists.html', 'fragments/artists.html',
+    ('artists', tuple(sorted(genres)), match), ('artist',),
+    lambda: {'artists': artist_listing(genres, match), 'genres': GENRES,
+      'selected': genres, 'match': match})
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
@@ -540,20 +1051,8 @@ def search_artists():
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
   search_term = request.form.get('search_term','')
-  search_result = db.session.query(Artist).filter(Artist.name.ilike(f'%{search_term}%')).all()
-  data = []
-  for result in search_result:
-    data.append({
-      'id': result.id,
-      'name': result.name,
-      'num_upcoming_shows': len(db.session.query(Show).filter(
-          Show.artist_id == result.id).filter(Show.start_time > datetime.now()).all())
-    })
-  
-  response = {
-    "count": len(search_result),
-    "data": data
-  }
+  after_id = request.form.get('after_id', None, type=int)
+  response = search_artist_page(search_term, after_id)
   """
   response={
     "count": 1,
@@ -566,6 +1065,11 @@ def search_artists():
   """
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
+@app.route('/artists/export')
+def export_artists():
+  # streams every artist as one json object per line (ndjson)
+  return export_response(Artist.query.order_by(Artist.id), Artist.details)
+
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
@@ -644,20 +1148,16 @@ def show_artist(artist_id):
   }
   data = list(filter(lambda d: d['id'] == artist_id, [data1, data2, data3]))[0]
   """
-  artist_query = Artist.query.get(artist_id)
-  if artist_query:
-    artist_details = Artist.details(artist_query)
-    #get the current system time
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    new_shows_query = Show.query.options(db.joinedload(Show.Artist)).filter(Show.artist_id == artist_id).filter(Show.start_time > current_time).all()
-    new_shows_list = list(map(Show.venue_details, new_shows_query))
-    artist_details["upcoming_shows"] = new_shows_list
-    artist_details["upcoming_shows_count"] = len(new_shows_list)
-    past_shows_query = Show.query.options(db.joinedload(Show.Artist)).filter(Show.artist_id == artist_id).filter(Show.start_time <= current_time).all()
-    past_shows_list = list(map(Show.venue_details, past_shows_query))
-    artist_details["past_shows"] = past_shows_list
-    artist_details["past_shows_count"] = len(past_shows_list)
-    return render_template('pages/show_artist.html', artist=artist_details)
+  def data():
+    artist_details = artist_page(artist_id)
+    if artist_details:
+      return {'artist': artist_details, 'title': artist_details['name']}
+
+  page = render_cached_page('pages/show_artist.html',
+    'fragments/show_artist.html', ('show_artist', artist_id),
+    ('artist', 'show', 'venue'), data)
+  if page:
+    return page
   return render_template('errors/404.html')
 #  Update
 #  ----------------------------------------------------------------
@@ -893,10 +1393,36 @@ def shows():
     "start_time": "2035-04-15T20:00:00.000Z"
   }]
   """
-  show_query = Show.query.options(db.joinedload(Show.Venue), db.joinedload(Show.Artist)).all()
-  data = list(map(Show.detail, show_query))
-
-  return render_template('pages/shows.html', shows=data)
+  # ?from=&to= limit the listing to a date window, ?after= continues from
+  # the cursor of the previous page and ?page=n jumps to a page
+  try:
+    start = request.args.get('from') or None
+    end = request.args.get('to') or None
+    start = start and dateutil.parser.parse(start)
+    end = end and parse_window_end(end)
+    after = request.args.get('after') or None
+    after = after and decode_show_cursor(after)
+    page = max(request.args.get('page', 1, type=int), 1)
+  except (ValueError, OverflowError):
+    abort(400)
+  data, next_after = show_listing(start, end, after, page)
+
+  window = {key: request.args[key] for key in ('from', 'to')
+    if request.args.get(key)}
+  return render_template('pages/shows.html', shows=data, window=window,
+    next_after=next_after, page=None if after else page)
+
+@app.route('/shows/export')
+def export_shows():
+  # streams every show as one json object per line (ndjson). Names come
+  # from a join in the same statement instead of a lookup per show.
+  rows = db.session.query(
+      Show.id, Show.venue_id, Venue.name, Show.artist_id, Artist.name,
+      Show.start_time
+    ).join(Venue, Venue.id == Show.venue_id
+    ).join(Artist, Artist.id == Show.artist_id
+    ).order_by(Show.id)
+  return export_response(rows, show_export_row)
 
 @app.route('/shows/create')
 def create_shows():
@@ -0,0 +1,113 @@
+'''
+Synthetic Fyyur data: N venues, M artists and K shows.
+
+Names, cities and genres are drawn from small fixed lists so listings group
+and search the way real data does; shows are spread over the year before
+and after today, so pages have both past and upcoming shows.
+
+    python -m benchmarks.generate --venues 500 --artists 2000 --shows 20000
+
+writes into the database configured for the app (DATABASE_URL or
+config.py). generate() is also used by the page rendering benchmark.
+'''
+import argparse
+import random
+from datetime import datetime, timedelta
+
+AREAS = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'),
+         ('Seattle', 'WA'), ('Chicago', 'IL'), ('Nashville', 'TN'),
+         ('Denver', 'CO'), ('Boston', 'MA')]
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic',
+          'Folk', 'Funk', 'Hip-Hop', 'Jazz', 'Pop', 'Punk', 'R&B', 'Reggae',
+          'Rock n Roll', 'Soul', 'Swing']
+WORDS = ['Musical', 'Hop', 'Dueling', 'Pianos', 'Park', 'Square', 'Live',
+         'Wild', 'Sax', 'Band', 'Guns', 'Petals', 'Blue', 'Moon', 'Velvet',
+         'Echo', 'Garden', 'Hall', 'Lounge', 'Club']
+IMAGE = 'https://images.unsplash.com/photo-1543900694-133f37abaaa5?w=400'
+
+
+def name(rng, number):
+    return '{} {} {}'.format(rng.choice(WORDS), rng.choice(WORDS), number)
+
+
+def venue_rows(rng, count):
+    for number in range(count):
+        city, state = rng.choice(AREAS)
+        yield {
+            'name': 'The ' + name(rng, number),
+            'genres': rng.sample(GENRES, rng.randint(1, 4)),
+            'address': '{} Folsom Street'.format(rng.randint(1, 2000)),
+            'city': city,
+            'state': state,
+            'phone': '123-123-{:04d}'.format(number % 10000),
+            'website': 'https://example.com/venues/{}'.format(number),
+            'facebook_link': 'https://www.facebook.com/venue{}'.format(number),
+            'image_link': IMAGE,
+            'seeking_talent': rng.random() < 0.5,
+            'seeking_description': '',
+        }
+
+
+def artist_rows(rng, count):
+    for number in range(count):
+        city, state = rng.choice(AREAS)
+        yield {
+            'name': name(rng, number),
+            'genres': rng.sample(GENRES, rng.randint(1, 3)),
+            'city': city,
+            'state': state,
+            'phone': '326-123-{:04d}'.format(number % 10000),
+            'website': 'https://example.com/artists/{}'.format(number),
+            'facebook_link': 'https://www.facebook.com/artist{}'.format(
+                number),
+            'image_link': IMAGE,
+            'seeking_venue': rng.random() < 0.5,
+            'seeking_description': '',
+        }
+
+
+def show_rows(rng, count, venue_ids, artist_ids, now):
+    for _ in range(count):
+        yield {
+            'venue_id': rng.choice(venue_ids),
+            'artist_id': rng.choice(artist_ids),
+            'start_time': now + timedelta(hours=rng.randint(-24 * 365,
+                                                            24 * 365)),
+        }
+
+
+def generate(db, models, venues, artists, shows, seed=1):
+    '''
+    generate(db, models, venues, artists, shows, seed=1)
+        bulk inserts the rows; models is (Venue, Artist, Show)
+    '''
+    Venue, Artist, Show = models
+    rng = random.Random(seed)
+    Venue.bulk_insert(venue_rows(rng, venues))
+    Artist.bulk_insert(artist_rows(rng, artists))
+    venue_ids = [row[0] for row in db.session.query(Venue.id)]
+    artist_ids = [row[0] for row in db.session.query(Artist.id)]
+    if venue_ids and artist_ids:
+        Show.bulk_insert(show_rows(rng, shows, venue_ids, artist_ids,
+                                   datetime.now()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--venues', type=int, default=100)
+    parser.add_argument('--artists', type=int, default=300)
+    parser.add_argument('--shows', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    from app import app, db, Venue, Artist, Show
+    with app.app_context():
+        db.create_all()
+        generate(db, (Venue, Artist, Show), args.venues, args.artists,
+                 args.shows, args.seed)
+    print('{} venues, {} artists and {} shows added'.format(
+        args.venues, args.artists, args.shows))
+
+
+if __name__ == '__main__':
+    main()
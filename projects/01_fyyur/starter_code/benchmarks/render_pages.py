@@ -0,0 +1,159 @@
+'''
+Time Fyyur's HTML pages end to end as the data set grows.
+
+For every scale the database (a throw-away SQLite file) is refilled with
+scale x (--venues, --artists, --shows) rows by benchmarks.generate, then
+each page is requested --repeat times through the test client. Every
+request is split into
+
+  db      time inside SQL statements (before/after_cursor_execute)
+  jinja   time inside render_template, minus any SQL run while rendering
+          (before_render_template / template_rendered signals)
+  python  everything else: routing, query building, assembling the data
+
+Every request is rendered from scratch: the fragment cache is off unless
+--cache is given, in which case repeated views of a page are cache hits.
+
+    python -m benchmarks.render_pages --scale 1 10 50 --repeat 20
+'''
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+handle, database_file = tempfile.mkstemp(suffix='.db')
+os.close(handle)
+os.environ['DATABASE_URL'] = 'sqlite:///{}'.format(database_file)
+
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+
+from app import app, db, Venue, Artist, Show, fragment_cache
+from cache import CacheBackend
+from benchmarks.generate import generate
+
+
+class Timer(object):
+    '''
+    Accumulates db and jinja time for the request being measured.
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.db = 0.0
+        self.jinja = 0.0
+        self._statement_started = []
+        self._render_started = []
+
+    def before_cursor_execute(self, *args):
+        self._statement_started.append(time.perf_counter())
+
+    def after_cursor_execute(self, *args):
+        self.db += time.perf_counter() - self._statement_started.pop()
+
+    def before_render(self, sender, template, context, **extra):
+        self._render_started.append((time.perf_counter(), self.db))
+
+    def rendered(self, sender, template, context, **extra):
+        started, db_before = self._render_started.pop()
+        elapsed = time.perf_counter() - started
+        self.jinja += elapsed - (self.db - db_before)
+
+
+def pages(rng):
+    venue_ids = [row[0] for row in db.session.query(Venue.id)]
+    artist_ids = [row[0] for row in db.session.query(Artist.id)]
+    return [
+        ('venues', lambda: '/venues'),
+        ('show_venue', lambda: '/venues/{}'.format(rng.choice(venue_ids))),
+        ('artists', lambda: '/artists'),
+        ('show_artist', lambda: '/artists/{}'.format(rng.choice(artist_ids))),
+        ('shows', lambda: '/shows'),
+    ]
+
+
+def measure(client, timer, url, repeat):
+    totals = {'total': [], 'db': [], 'jinja': [], 'python': []}
+    for _ in range(repeat):
+        timer.reset()
+        started = time.perf_counter()
+        response = client.get(url())
+        total = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError('{} returned {}'.format(url(),
+                                                      response.status_code))
+        totals['total'].append(total)
+        totals['db'].append(timer.db)
+        totals['jinja'].append(timer.jinja)
+        totals['python'].append(total - timer.db - timer.jinja)
+    return {part: round(sum(values) / len(values) * 1000, 3)
+            for part, values in totals.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--venues', type=int, default=20)
+    parser.add_argument('--artists', type=int, default=50)
+    parser.add_argument('--shows', type=int, default=200)
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 5, 25])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help='also write the results as JSON')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--cache', action='store_true',
+                        help='serve repeated views from the fragment cache')
+    args = parser.parse_args()
+    if not args.cache:
+        fragment_cache.backend = CacheBackend()
+
+    timer = Timer()
+    results = []
+    try:
+        with app.app_context():
+            engine = db.get_engine()
+            event.listen(engine, 'before_cursor_execute',
+                         timer.before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute',
+                         timer.after_cursor_execute)
+            before_render_template.connect(timer.before_render, app)
+            template_rendered.connect(timer.rendered, app)
+
+            print('{:>7} {:<12} {:>10} {:>10} {:>10} {:>10}'.format(
+                'scale', 'page', 'total ms', 'db ms', 'python ms',
+                'jinja ms'))
+            for scale in args.scale:
+                db.session.remove()
+                db.drop_all()
+                db.create_all()
+                generate(db, (Venue, Artist, Show), args.venues * scale,
+                         args.artists * scale, args.shows * scale, args.seed)
+
+                client = app.test_client()
+                rng = random.Random(args.seed)
+                for page, url in pages(rng):
+                    client.get(url())  # warm up caches and templates
+                    timing = measure(client, timer, url, args.repeat)
+                    results.append(dict(timing, scale=scale, page=page))
+                    print('{:>7} {:<12} {:>10.2f} {:>10.2f} {:>10.2f} '
+                          '{:>10.2f}'.format(scale, page, timing['total'],
+                                             timing['db'], timing['python'],
+                                             timing['jinja']))
+    finally:
+        os.remove(database_file)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'venues': args.venues,
+                'artists': args.artists,
+                'shows': args.shows,
+                'repeat': args.repeat,
+                'cache': args.cache,
+                'results': results,
+            }, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+'''
+Fragment cache for rendered templates.
+
+A fragment is stored under a key (e.g. ('show_venue', 1)) together with the
+versions of the tables it was rendered from. Every commit that writes to a
+table, and every bulk write, bumps that table's version, so an entry
+rendered from older data no longer matches and is rendered again.
+
+  memory  - in-process LRU of FRAGMENT_CACHE_SIZE entries
+  disk    - one file per key under FRAGMENT_CACHE_DIR (by default
+            fragments/ in the app's instance folder), shared by the
+            worker processes of one host; the FRAGMENT_CACHE_SIZE most
+            recently used files are kept
+  null    - caches nothing
+
+Entries also expire after FRAGMENT_CACHE_TIMEOUT seconds: pages split shows
+into past and upcoming by the current time, which no write announces.
+Cached values are dicts of strings, the rendered HTML under 'content'.
+
+    fragment_cache = create_fragment_cache(app, db)
+    content = fragment_cache.fetch(('show_venue', venue_id),
+                                   ('venue', 'show', 'artist'), render)
+'''
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: version bumps are not serialized
+    fcntl = None
+
+from sqlalchemy import event
+
+
+def create_fragment_cache(app, db=None):
+    '''
+    create_fragment_cache(app, db=None)
+        returns a FragmentCache on the backend named by the
+        FRAGMENT_CACHE_BACKEND config value, watching db's session for
+        writes when db is given
+    '''
+    app.config.setdefault('FRAGMENT_CACHE_BACKEND', 'memory')
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', 1000)
+    app.config.setdefault('FRAGMENT_CACHE_DIR', os.path.join(
+        app.instance_path, 'fragments'))
+    app.config.setdefault('FRAGMENT_CACHE_TIMEOUT', 300)
+
+    name = app.config['FRAGMENT_CACHE_BACKEND']
+    if name == 'memory':
+        backend = MemoryBackend(app.config['FRAGMENT_CACHE_SIZE'])
+    elif name == 'disk':
+        backend = DiskBackend(app.config['FRAGMENT_CACHE_DIR'],
+                              app.config['FRAGMENT_CACHE_SIZE'])
+    elif name == 'null':
+        backend = CacheBackend()
+    else:
+        raise ValueError('Unknown fragment cache backend: {}'.format(name))
+    cache = FragmentCache(backend, app.config['FRAGMENT_CACHE_TIMEOUT'])
+    if db is not None:
+        cache.watch(db.session)
+    return cache
+
+
+class FragmentCache(object):
+    def __init__(self, backend, timeout):
+        self.backend = backend
+        self.timeout = timeout
+
+    def fetch(self, key, tables, render):
+        '''
+        fetch(key, tables, render)
+            returns the entry stored under key if it was rendered from the
+            current versions of tables and has not expired, otherwise calls
+            render() and stores its result. None results are not stored.
+        '''
+        # versions are read before rendering: a write landing meanwhile
+        # leaves an entry that already looks stale
+        versions = tuple(self.backend.version(table) for table in tables)
+        now = time.time()
+        entry = self.backend.get(key)
+        if entry is not None:
+            stored, expires, value = entry
+            if stored == versions and expires > now:
+                return value
+        value = render()
+        if value is not None:
+            self.backend.set(key, (versions, now + self.timeout, value))
+        return value
+
+    def bump(self, *tables):
+        '''
+        bump(*tables)
+            marks every entry rendered from tables as stale
+        '''
+        for table in tables:
+            self.backend.bump(table)
+
+    def watch(self, session):
+        '''
+        watch(session)
+            bumps the tables each commit wrote to, including bulk query
+            updates and deletes
+        '''
+        def flushed(session, flush_context):
+            written = session.info.setdefault('fragment_cache_tables', set())
+            for instance in session.new | session.dirty | session.deleted:
+                table = getattr(instance, '__table__', None)
+                if table is not None:
+                    written.add(table.name)
+
+        def bulk_written(context):
+            context.session.info.setdefault(
+                'fragment_cache_tables', set()).add(
+                    context.mapper.local_table.name)
+
+        def committed(session):
+            self.bump(*session.info.pop('fragment_cache_tables', ()))
+
+        def rolled_back(session):
+            session.info.pop('fragment_cache_tables', None)
+
+        event.listen(session, 'after_flush', flushed)
+        event.listen(session, 'after_bulk_update', bulk_written)
+        event.listen(session, 'after_bulk_delete', bulk_written)
+        event.listen(session, 'after_commit', committed)
+        event.listen(session, 'after_rollback', rolled_back)
+
+    def watch_bulk(self, model):
+        '''
+        watch_bulk(model)
+            bumps model's table after each of its BulkMixin writes, which
+            go around the session's flush
+        '''
+        model.on_bulk_change(lambda: self.bump(model.__table__.name))
+
+    def clear(self):
+        self.backend.clear()
+
+
+class CacheBackend(object):
+    '''
+    Stores nothing; the interface the other backends implement.
+    '''
+    def get(self, key):
+        return None
+
+    def set(self, key, entry):
+        pass
+
+    def version(self, table):
+        return 0
+
+    def bump(self, table):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def version(self, table):
+        return self._versions.get(table, 0)
+
+    def bump(self, table):
+        with self._lock:
+            self._versions[table] = self._versions.get(table, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DiskBackend(CacheBackend):
+    '''
+    Entries are plain text files, one per key, replaced atomically: a line
+    of JSON metadata followed by the fragment HTML. An entry for a key
+    overwrites the one before it, and a hit refreshes the file's mtime;
+    once there are more than size files the least recently used go. A
+    table's version is a counter in its version file, which bump()
+    increments under a lock and replaces atomically, so every process on
+    the host sees every other's writes.
+
+    The directory must belong to the user running the app and is kept
+    private (0700), as whatever it holds is served as HTML.
+    '''
+    def __init__(self, directory, size=1000):
+        self.directory = directory
+        self.size = size
+        self.entries = os.path.join(directory, 'entries')
+        self.versions = os.path.join(directory, 'versions')
+        for path in (directory, self.entries, self.versions):
+            private_directory(path)
+
+    def get(self, key):
+        try:
+            with open(self._entry_path(key), encoding='utf-8') as entry:
+                metadata = json.loads(entry.readline())
+                content = entry.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        if metadata.get('key') != repr(key):
+            return None
+        try:
+            os.utime(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+        value = dict(metadata['value'], content=content)
+        return tuple(metadata['versions']), metadata['expires'], value
+
+    def set(self, key, entry):
+        versions, expires, value = entry
+        value = dict(value)
+        content = value.pop('content', '')
+        metadata = json.dumps({
+            'key': repr(key),
+            'versions': list(versions),
+            'expires': expires,
+            'value': value,
+        })
+        self._replace(self.entries, self._entry_path(key),
+                      metadata + '\n' + content)
+        self._evict()
+
+    def version(self, table):
+        try:
+            with open(os.path.join(self.versions, table)) as versions:
+                return int(versions.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def bump(self, table):
+        path = os.path.join(self.versions, table)
+        with open(path + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            self._replace(self.versions, path, str(self.version(table) + 1))
+
+    def clear(self):
+        for name in os.listdir(self.entries):
+            if not name.startswith('.'):
+                os.remove(os.path.join(self.entries, name))
+
+    def _replace(self, directory, path, text):
+        # readers see the old file or the new one, never a partial write.
+        # Temporary files start with a dot, which _evict() and clear() skip.
+        handle, temporary = tempfile.mkstemp(dir=directory, prefix='.')
+        try:
+            with os.fdopen(handle, 'w', encoding='utf-8') as output:
+                output.write(text)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.entries):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+        if len(entries) <= self.size:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.size]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _entry_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.entries, digest)
+
+
+def private_directory(path):
+    '''
+    private_directory(path)
+        creates path with mode 0700 unless it exists, and makes sure it
+        belongs to the current user and nobody else can write to it
+    '''
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not hasattr(os, 'getuid'):
+        return
+    status = os.stat(path)
+    if status.st_uid != os.getuid():
+        raise ValueError('Fragment cache directory {} is owned by another '
+                         'user'.format(path))
+    if status.st_mode & 0o077:
+        os.chmod(path, 0o700)
@@ -0,0 +1,181 @@
+'''
+Genre filters for the ARRAY genres columns.
+
+A backend turns a list of genres into a filter clause on a model's genres
+column, so filters compose with the rest of a query the way searches do.
+
+  array   - @> (has all the genres) / && (has any of them) served by the
+            GIN indexes on venue.genres and artist.genres (Postgres)
+  bitmap  - in-process genre -> row id bitmaps, for SQLite test databases
+            where genres is stored as JSON
+'''
+import threading
+from sqlalchemy import event, literal, type_coerce
+from sqlalchemy.dialects import postgresql
+
+from search import primary_key
+
+MATCHES = ('all', 'any')
+
+
+def create_genre_backend(app, db):
+    '''
+    create_genre_backend(app, db)
+        returns the backend named by the GENRE_FILTER_BACKEND config value.
+        When it is not set the backend is picked from the database dialect.
+    '''
+    name = app.config.get('GENRE_FILTER_BACKEND')
+    if not name:
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+        name = 'bitmap' if uri.startswith('sqlite') else 'array'
+    if name not in GENRE_BACKENDS:
+        raise ValueError('Unknown genre filter backend: {}'.format(name))
+    return GENRE_BACKENDS[name](db)
+
+
+class GenreBackend(object):
+    def __init__(self, db):
+        self.db = db
+        self.columns = []
+
+    def register(self, column):
+        '''
+        register(column)
+            makes a model's genres column (e.g. Venue.genres) filterable
+        '''
+        self.columns.append(column)
+
+    def filter(self, column, genres, match='all'):
+        '''
+        filter(column, genres, match='all')
+            returns a clause matching rows listing all of genres, or any of
+            them when match is 'any'
+        '''
+        raise NotImplementedError()
+
+
+class ArrayGenreBackend(GenreBackend):
+    def filter(self, column, genres, match='all'):
+        array = postgresql.ARRAY(self.db.String())
+        # the model declares the generic ARRAY, which has no @> / &&
+        column = type_coerce(column, array)
+        genres = literal(list(genres), array)
+        if match == 'any':
+            return column.overlap(genres)
+        return column.contains(genres)
+
+
+class BitmapGenreBackend(GenreBackend):
+    '''
+    Keeps one int per genre and column with bit n set when row n lists the
+    genre, so a filter is a few ANDs/ORs over ints. Bitmaps are loaded on
+    first use and then kept current by mapper events; models with a
+    BulkMixin drop them after each bulk write.
+    '''
+    def __init__(self, db):
+        super(BitmapGenreBackend, self).__init__(db)
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def register(self, column):
+        super(BitmapGenreBackend, self).register(column)
+        model = column.class_
+
+        def changed(mapper, connection, target):
+            self._update(column, target, getattr(target, column.key))
+
+        def deleted(mapper, connection, target):
+            self._update(column, target, None)
+
+        event.listen(model, 'after_insert', changed)
+        event.listen(model, 'after_update', changed)
+        event.listen(model, 'after_delete', deleted)
+        # bulk writes skip the mapper events, reload after them instead
+        if hasattr(model, 'on_bulk_change'):
+            model.on_bulk_change(lambda: self.invalidate(column))
+
+    def invalidate(self, column=None):
+        '''
+        invalidate(column=None)
+            drops the bitmaps for column (or all of them) so they are
+            reloaded on the next filter, e.g. after a bulk write
+        '''
+        with self._lock:
+            if column is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(column, None)
+
+    def filter(self, column, genres, match='all'):
+        key = primary_key(column)
+        with self._lock:
+            ids = self._load(column).match(genres, match)
+        return key.in_(ids)
+
+    def _load(self, column):
+        index = self._indexes.get(column)
+        if index is None:
+            index = GenreBitmaps()
+            rows = self.db.session.query(primary_key(column), column)
+            for row_id, genres in rows:
+                index.add(row_id, genres)
+            self._indexes[column] = index
+        return index
+
+    def _update(self, column, target, genres):
+        with self._lock:
+            index = self._indexes.get(column)
+            if index is None:
+                return
+            row_id = getattr(target, primary_key(column).key)
+            index.remove(row_id)
+            if genres is not None:
+                index.add(row_id, genres)
+
+
+class GenreBitmaps(object):
+    def __init__(self):
+        self.documents = {}
+        self.bitmaps = {}
+
+    def add(self, row_id, genres):
+        genres = frozenset(genres or ())
+        self.documents[row_id] = genres
+        for genre in genres:
+            self.bitmaps[genre] = self.bitmaps.get(genre, 0) | (1 << row_id)
+
+    def remove(self, row_id):
+        genres = self.documents.pop(row_id, None)
+        if genres is None:
+            return
+        for genre in genres:
+            bitmap = self.bitmaps[genre] & ~(1 << row_id)
+            if bitmap:
+                self.bitmaps[genre] = bitmap
+            else:
+                del self.bitmaps[genre]
+
+    def match(self, genres, match='all'):
+        bitmaps = [self.bitmaps.get(genre, 0) for genre in set(genres)]
+        if not bitmaps:
+            return list(self.documents)
+        bits = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            bits = bits | bitmap if match == 'any' else bits & bitmap
+        return row_ids(bits)
+
+
+def row_ids(bits):
+    # positions of the set bits, lowest first
+    ids = []
+    while bits:
+        lowest = bits & -bits
+        ids.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return ids
+
+
+GENRE_BACKENDS = {
+    'array': ArrayGenreBackend,
+    'bitmap': BitmapGenreBackend,
+}
@@ -0,0 +1,282 @@
+'''
+Bulk import of venues, artists and shows from CSV or NDJSON files.
+
+    flask fyyur import venues venues.csv
+    flask fyyur import shows shows.ndjson --chunk-size 10000
+
+Every row is validated with the same form class the create pages use, then
+loaded a chunk at a time: with COPY on Postgres, and with the models'
+bulk_insert() (chunked executemany) elsewhere. Shows may name their artist
+and venue (artist_name / venue_name) instead of giving ids; names and ids
+are resolved with one query per chunk, not one per row.
+'''
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+
+import click
+import dateutil.parser
+from flask.cli import with_appcontext
+from werkzeug.datastructures import MultiDict
+
+
+class ImportTarget(object):
+    '''
+    ImportTarget(model, form_class, references=None)
+        where the rows of one kind go. references maps a foreign key
+        column (e.g. 'artist_id') to the model it points at; rows may give
+        either the id or the referenced row's name ('artist_name').
+    '''
+    def __init__(self, model, form_class, references=None):
+        self.model = model
+        self.form_class = form_class
+        self.references = references or {}
+        self.columns = [column.name for column in model.__table__.columns
+                        if not column.primary_key]
+
+
+class Reference(object):
+    def __init__(self, column, model):
+        self.column = column
+        self.model = model
+        self.name_key = column[:-len('_id')] + '_name'
+        self.ids = set()
+        self.names = {}
+
+    def resolve(self, db, rows):
+        '''
+        resolve(db, rows)
+            fills in the foreign key of every row of a chunk from a single
+            query. Returns {row index: error} for rows that point nowhere.
+        '''
+        ids, names = set(), set()
+        for row in rows:
+            if row.get(self.column) not in (None, ''):
+                ids.add(as_int(row[self.column]))
+            elif row.get(self.name_key):
+                names.add(row[self.name_key])
+        ids -= self.ids
+        ids.discard(None)
+        names -= set(self.names)
+
+        if ids or names:
+            query = db.session.query(self.model.id, self.model.name).filter(
+                db.or_(self.model.id.in_(ids), self.model.name.in_(names))
+            ).order_by(self.model.id)
+            for row_id, name in query:
+                self.ids.add(row_id)
+                # the oldest row wins when a name is used twice
+                self.names.setdefault(name, row_id)
+
+        errors = {}
+        for index, row in enumerate(rows):
+            if row.get(self.column) not in (None, ''):
+                if as_int(row[self.column]) not in self.ids:
+                    errors[index] = 'unknown {} {}'.format(
+                        self.column, row[self.column])
+            elif row.get(self.name_key) in self.names:
+                row[self.column] = self.names[row[self.name_key]]
+            else:
+                errors[index] = 'unknown {} {!r}'.format(
+                    self.name_key, row.get(self.name_key))
+        return errors
+
+
+class Importer(object):
+    def __init__(self, db, target, chunk_size=5000):
+        self.db = db
+        self.target = target
+        self.chunk_size = chunk_size
+        self.references = [Reference(column, model) for column, model
+                           in sorted(target.references.items())]
+        self.loaded = 0
+        self.errors = []
+
+    def run(self, rows):
+        '''
+        run(rows)
+            validates and loads (line number, row) pairs, returns the number
+            of rows loaded. Rejected rows are collected in self.errors.
+        '''
+        chunk = []
+        for line, row in rows:
+            chunk.append((line, row))
+            if len(chunk) == self.chunk_size:
+                self._load_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._load_chunk(chunk)
+        return self.loaded
+
+    def _load_chunk(self, chunk):
+        rows = [row for _, row in chunk]
+        rejected = {}
+        for reference in self.references:
+            for index, error in reference.resolve(self.db, rows).items():
+                rejected.setdefault(index, error)
+
+        records = []
+        for index, (line, row) in enumerate(chunk):
+            if index in rejected:
+                self.errors.append((line, rejected[index]))
+                continue
+            record, error = self._validate(row)
+            if error:
+                self.errors.append((line, error))
+            else:
+                records.append(record)
+
+        if not records:
+            return
+        if self.db.engine.dialect.name == 'postgresql':
+            self._copy(records)
+        else:
+            self.target.model.bulk_insert(records)
+        self.loaded += len(records)
+
+    def _validate(self, row):
+        form = self.target.form_class(formdata=row_formdata(row),
+                                      meta={'csrf': False})
+        if not form.validate():
+            return None, '; '.join(
+                '{}: {}'.format(field, ' '.join(messages))
+                for field, messages in sorted(form.errors.items()))
+        record = {column: form.data[column]
+                  for column in self.target.columns if column in form.data}
+        for reference in self.references:
+            record[reference.column] = as_int(record[reference.column])
+        return record, None
+
+    def _copy(self, records):
+        columns = [column for column in self.target.columns
+                   if column in records[0]]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for record in records:
+            writer.writerow([copy_value(record[column]) for column in columns])
+        buffer.seek(0)
+
+        table = self.target.model.__table__.name
+        statement = 'COPY "{}" ({}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')' \
+            .format(table, ', '.join('"{}"'.format(c) for c in columns))
+        model = self.target.model
+        try:
+            cursor = self.db.session.connection().connection.cursor()
+            # bulk_chunk keeps data derived from the rows (show counts)
+            # right in the same transaction, as bulk_insert() does
+            model.bulk_chunk('insert', records, lambda: cursor.copy_expert(
+                statement, buffer))
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            raise
+        # COPY bypasses the ORM just like bulk_insert() does
+        model.after_bulk_change()
+
+
+def read_rows(path):
+    '''
+    read_rows(path)
+        yields (line number, row dict) from a .csv file (header row first,
+        list values such as genres comma separated) or a .ndjson / .jsonl
+        file (one json object per line)
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='') as data_file:
+        if extension == '.csv':
+            reader = csv.DictReader(data_file)
+            for row in reader:
+                if 'genres' in row:
+                    row['genres'] = [genre.strip() for genre
+                                     in (row['genres'] or '').split(',')
+                                     if genre.strip()]
+                yield reader.line_num, row
+        elif extension in ('.ndjson', '.jsonl'):
+            for line, text in enumerate(data_file, start=1):
+                if text.strip():
+                    yield line, json.loads(text)
+        else:
+            raise click.BadParameter(
+                'expected a .csv, .ndjson or .jsonl file: {}'.format(path))
+
+
+def row_formdata(row):
+    data = MultiDict()
+    for key, value in row.items():
+        for item in (value if isinstance(value, list) else [value]):
+            if item is None:
+                continue
+            if isinstance(item, bool):
+                item = 'true' if item else 'false'
+            elif key.endswith('_time') and isinstance(item, str):
+                item = form_datetime(item)
+            data.add(key, str(item))
+    return data
+
+
+def form_datetime(value):
+    # DateTimeField only reads '%Y-%m-%d %H:%M:%S'; accept ISO 8601 too,
+    # which is what /shows/export writes
+    try:
+        return dateutil.parser.parse(value).strftime('%Y-%m-%d %H:%M:%S')
+    except (ValueError, OverflowError):
+        return value
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        return '{' + ','.join('"{}"'.format(
+            str(item).replace('\\', '\\\\').replace('"', '\\"'))
+            for item in value) + '}'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return value
+
+
+def as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def create_import_command(db, targets):
+    '''
+    create_import_command(db, targets)
+        returns the `import` click command for a {kind: ImportTarget} map
+    '''
+    @click.command('import')
+    @click.argument('kind', type=click.Choice(sorted(targets)))
+    @click.argument('paths', nargs=-1, required=True,
+                    type=click.Path(exists=True, dir_okay=False))
+    @click.option('--chunk-size', default=5000, show_default=True,
+                  help='Rows validated and loaded per transaction.')
+    @click.option('--max-errors', default=20, show_default=True,
+                  help='Rejected rows to print per file.')
+    @with_appcontext
+    def import_command(kind, paths, chunk_size, max_errors):
+        '''Load venues, artists or shows from CSV / NDJSON files.'''
+        for path in paths:
+            importer = Importer(db, targets[kind], chunk_size=chunk_size)
+            start = time.perf_counter()
+            importer.run(read_rows(path))
+            elapsed = time.perf_counter() - start
+
+            for line, error in importer.errors[:max_errors]:
+                click.echo('{}:{}: {}'.format(path, line, error), err=True)
+            if len(importer.errors) > max_errors:
+                click.echo('{}: {} more rejected rows'.format(
+                    path, len(importer.errors) - max_errors), err=True)
+            click.echo('{}: {} {} loaded, {} rejected in {:.2f}s '
+                       '({:.0f} rows/s)'.format(
+                           path, importer.loaded, kind, len(importer.errors),
+                           elapsed, importer.loaded / elapsed if elapsed else 0))
+
+    return import_command
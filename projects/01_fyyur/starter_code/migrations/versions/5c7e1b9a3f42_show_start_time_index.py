@@ -0,0 +1,27 @@
+"""show start_time index
+
+Revision ID: 5c7e1b9a3f42
+Revises: 8a4e6c0f2d31
+Create Date: 2026-10-18 19:12:05.511870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c7e1b9a3f42'
+down_revision = '8a4e6c0f2d31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # /shows reads one page at a time in (start_time, id) order, optionally
+    # inside a start_time window; this index serves both without a sort.
+    op.create_index('ix_show_start_time_id', 'show', ['start_time', 'id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_show_start_time_id', table_name='show')
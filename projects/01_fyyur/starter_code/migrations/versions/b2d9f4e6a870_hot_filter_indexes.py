@@ -0,0 +1,41 @@
+"""hot filter indexes
+
+Revision ID: b2d9f4e6a870
+Revises: 5c7e1b9a3f42
+Create Date: 2026-10-18 19:31:48.207113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2d9f4e6a870'
+down_revision = '5c7e1b9a3f42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # venue and artist pages read a venue's / artist's shows, the listings
+    # count upcoming shows per venue / artist
+    op.create_index('ix_show_venue_id_start_time', 'show',
+                    ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_show_artist_id_start_time', 'show',
+                    ['artist_id', 'start_time'], unique=False)
+    # /venues groups venues by area
+    op.create_index('ix_venue_city_state', 'venue', ['city', 'state'],
+                    unique=False)
+    # genre containment / overlap filters (@>, &&) on the ARRAY columns
+    op.create_index('ix_venue_genres', 'venue', ['genres'], unique=False,
+                    postgresql_using='gin')
+    op.create_index('ix_artist_genres', 'artist', ['genres'], unique=False,
+                    postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_artist_genres', table_name='artist')
+    op.drop_index('ix_venue_genres', table_name='venue')
+    op.drop_index('ix_venue_city_state', table_name='venue')
+    op.drop_index('ix_show_artist_id_start_time', table_name='show')
+    op.drop_index('ix_show_venue_id_start_time', table_name='show')
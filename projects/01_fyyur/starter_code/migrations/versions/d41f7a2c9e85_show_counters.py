@@ -0,0 +1,43 @@
+"""show counters
+
+Revision ID: d41f7a2c9e85
+Revises: b2d9f4e6a870
+Create Date: 2026-10-18 20:04:37.618254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41f7a2c9e85'
+down_revision = 'b2d9f4e6a870'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table, key in (('venue', 'venue_id'), ('artist', 'artist_id')):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(),
+                                       server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(),
+                                       server_default='0', nullable=False))
+        op.add_column(table, sa.Column('shows_counted_at', sa.DateTime(),
+                                       nullable=True))
+        # count the existing shows once; from here on Show inserts and
+        # deletes and `flask fyyur rollover` keep the counts current
+        op.execute(
+            'UPDATE {0} SET '
+            'upcoming_shows_count = (SELECT count(*) FROM show '
+            'WHERE show.{1} = {0}.id AND show.start_time > LOCALTIMESTAMP), '
+            'past_shows_count = (SELECT count(*) FROM show '
+            'WHERE show.{1} = {0}.id AND (show.start_time <= LOCALTIMESTAMP '
+            'OR show.start_time IS NULL)), '
+            'shows_counted_at = LOCALTIMESTAMP'.format(table, key))
+
+
+def downgrade():
+    for table in ('artist', 'venue'):
+        op.drop_column(table, 'shows_counted_at')
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -0,0 +1,698 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from urllib.request import urlopen
+
+handle, database_file = tempfile.mkstemp(suffix='.db')
+os.close(handle)
+# TEST_DATABASE_URL runs the suite against another database, e.g. Postgres
+os.environ['DATABASE_URL'] = os.environ.get(
+    'TEST_DATABASE_URL', 'sqlite:///{}'.format(database_file))
+
+from sqlalchemy import event
+from werkzeug.serving import make_server
+
+from app import app, db, Venue, Artist, Show, show_listing, \
+    decode_show_cursor, genre_backend, rollover_shows, metrics, \
+    search_artist_page, partition_shows, fragment_cache
+from benchmarks.generate import generate
+from cache import FragmentCache, DiskBackend
+
+# a plan line reading a whole table instead of going through an index
+FULL_SCAN = {
+    'sqlite': re.compile(r'^SCAN (TABLE )?(show|venue|artist)\b(?!.*INDEX)'),
+    'postgresql': re.compile(r'Seq Scan on (show|venue|artist)\b'),
+}
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and create a small data set."""
+        self.app = app
+        self.client = self.app.test_client
+        self.statements = []
+        self.executed = []
+
+        with self.app.app_context():
+            db.create_all()
+            self.venue_id = self.add_venue('The Musical Hop')
+            self.artist_ids = [self.add_artist('Artist {}'.format(i))
+                               for i in range(3)]
+            now = datetime.now()
+            for i, artist_id in enumerate(self.artist_ids):
+                self.add_show(self.venue_id, artist_id,
+                              now - timedelta(days=i + 1))
+                self.add_show(self.venue_id, artist_id,
+                              now + timedelta(days=i + 1))
+            db.session.commit()
+
+        event.listen(db.get_engine(self.app), 'before_cursor_execute',
+                     self.count_statement)
+
+    def tearDown(self):
+        """Executed after reach test"""
+        event.remove(db.get_engine(self.app), 'before_cursor_execute',
+                     self.count_statement)
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        # drop_all skips the mapper events that keep the bitmaps current
+        if hasattr(genre_backend, 'invalidate'):
+            genre_backend.invalidate()
+
+    def count_statement(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        self.statements.append(statement)
+        self.executed.append((statement, parameters))
+
+    def seed(self):
+        """Add a few thousand rows so the planner has something to plan."""
+        with self.app.app_context():
+            generate(db, (Venue, Artist, Show), 50, 150, 2000)
+            db.session.execute('ANALYZE')
+            db.session.commit()
+        self.statements = []
+        self.executed = []
+
+    def full_scans(self):
+        """EXPLAIN the statements run since seed(), return the plan lines
+        reading show, venue or artist without an index."""
+        scans = []
+        with self.app.app_context():
+            dialect = db.engine.dialect.name
+            connection = db.engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                if dialect == 'postgresql':
+                    # small tables are cheaper to read whole, so the planner
+                    # would pick a sequential scan even with a usable index
+                    cursor.execute('SET enable_seqscan = off')
+                    explain = 'EXPLAIN '
+                else:
+                    explain = 'EXPLAIN QUERY PLAN '
+                for statement, parameters in self.executed:
+                    cursor.execute(explain + statement, parameters)
+                    for row in cursor.fetchall():
+                        line = row[-1].strip().lstrip('-> ')
+                        if FULL_SCAN[dialect].search(line):
+                            scans.append('{}: {}'.format(
+                                line, ' '.join(statement.split())))
+            finally:
+                connection.rollback()
+                connection.close()
+        return scans
+
+    def add_venue(self, name, genres=('Jazz',)):
+        venue = Venue(name=name, genres=list(genres),
+                      address='1015 Folsom Street',
+                      city='San Francisco', state='CA', phone='',
+                      website='', facebook_link='', image_link='')
+        db.session.add(venue)
+        db.session.flush()
+        return venue.id
+
+    def add_artist(self, name, genres=('Jazz',)):
+        artist = Artist(name=name, genres=list(genres), city='San Francisco',
+                        state='CA', phone='', website='', facebook_link='',
+                        image_link='')
+        db.session.add(artist)
+        db.session.flush()
+        return artist.id
+
+    def counts(self, model, row_id):
+        with self.app.app_context():
+            row = model.query.get(row_id)
+            return row.upcoming_shows_count, row.past_shows_count
+
+    def add_show(self, venue_id, artist_id, start_time):
+        db.session.add(Show(venue_id=venue_id, artist_id=artist_id,
+                            start_time=start_time))
+
+    def run_import(self, kind, name, text):
+        """Write text to a file named name and run `flask fyyur import`
+        on it, return the command's output."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, name)
+        with open(path, 'w') as data_file:
+            data_file.write(text)
+        result = self.app.test_cli_runner().invoke(
+            args=['fyyur', 'import', kind, path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+    #Test 1
+    def test_show_venue_statement_count(self):
+        res = self.client().get('/venues/{}'.format(self.venue_id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'3 Upcoming Shows', res.data)
+        self.assertIn(b'3 Past Shows', res.data)
+        self.assertEqual(len(self.statements), 2)
+
+    #Test 2
+    def test_show_artist_statement_count(self):
+        res = self.client().get('/artists/{}'.format(self.artist_ids[0]))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'1 Upcoming Show', res.data)
+        self.assertIn(b'1 Past Show', res.data)
+        self.assertEqual(len(self.statements), 2)
+
+    #Test 3
+    def test_show_venue_statement_count_does_not_grow_with_shows(self):
+        with self.app.app_context():
+            for artist_id in self.artist_ids:
+                for day in range(10, 20):
+                    self.add_show(self.venue_id, artist_id,
+                                  datetime.now() + timedelta(days=day))
+            db.session.commit()
+        self.statements = []
+
+        res = self.client().get('/venues/{}'.format(self.venue_id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'33 Upcoming Shows', res.data)
+        self.assertEqual(len(self.statements), 2)
+
+    #Test 4
+    def test_show_missing_venue(self):
+        res = self.client().get('/venues/1000')
+
+        self.assertIn(b'nothing here', res.data)
+        self.assertEqual(len(self.statements), 1)
+
+    #Test 5
+    def test_sql_metrics(self):
+        res = self.client().get('/venues/{}'.format(self.venue_id))
+        self.assertIn('desc="2 statements"', res.headers['Server-Timing'])
+
+        res = self.client().get('/metrics')
+        body = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('sql_statements_total{endpoint="show_venue"}', body)
+
+    #Test 6
+    def test_request_metrics(self):
+        self.client().get('/venues/{}'.format(self.venue_id))
+
+        res = self.client().get('/metrics')
+        body = res.get_data(as_text=True)
+
+        self.assertIn('http_request_duration_seconds_bucket'
+                      '{endpoint="show_venue",le="+Inf"}', body)
+        self.assertIn('http_responses_total{endpoint="show_venue",'
+                      'status="200"}', body)
+        self.assertIn('http_requests_in_flight{endpoint="metrics"} 1', body)
+
+
+    #Test 7
+    def test_shows_date_window(self):
+        start = (datetime.now() + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M')
+        res = self.client().get('/shows?from={}'.format(start))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data.count(b'tile-show'), 3)
+        self.assertEqual(len(self.statements), 1)
+
+    #Test 8
+    def test_shows_cursor_pages(self):
+        self.app.config['SHOWS_PER_PAGE'] = 4
+        try:
+            with self.app.app_context():
+                first, cursor = show_listing()
+                second, last_cursor = show_listing(
+                    after=decode_show_cursor(cursor))
+            res = self.client().get('/shows?after={}'.format(cursor))
+        finally:
+            self.app.config['SHOWS_PER_PAGE'] = 30
+
+        self.assertEqual(len(first), 4)
+        self.assertEqual(len(second), 2)
+        self.assertIsNone(last_cursor)
+        times = [show['start_time'] for show in first + second]
+        self.assertEqual(times, sorted(times))
+        self.assertEqual(res.data.count(b'tile-show'), 2)
+
+    #Test 9
+    def test_400_shows_bad_cursor(self):
+        res = self.client().get('/shows?after=yesterday')
+
+        self.assertEqual(res.status_code, 400)
+
+    #Test 10
+    def test_show_venue_uses_indexes(self):
+        self.seed()
+        res = self.client().get('/venues/{}'.format(self.venue_id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.full_scans(), [])
+
+    #Test 11
+    def test_show_artist_uses_indexes(self):
+        self.seed()
+        res = self.client().get('/artists/{}'.format(self.artist_ids[0]))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.full_scans(), [])
+
+    #Test 12
+    def test_venues_uses_indexes(self):
+        self.seed()
+        res = self.client().get('/venues')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.full_scans(), [])
+
+    #Test 13
+    def test_venues_genre_filter(self):
+        with self.app.app_context():
+            self.add_venue('Folk Hall', ['Folk', 'Jazz'])
+            self.add_venue('Blues Bar', ['Blues'])
+            db.session.commit()
+
+        res = self.client().get('/venues?genre=Jazz&genre=Folk')
+        self.assertIn(b'Folk Hall', res.data)
+        self.assertNotIn(b'The Musical Hop', res.data)
+        self.assertNotIn(b'Blues Bar', res.data)
+
+        res = self.client().get('/venues?genre=Folk&genre=Blues&match=any')
+        self.assertIn(b'Folk Hall', res.data)
+        self.assertIn(b'Blues Bar', res.data)
+        self.assertNotIn(b'The Musical Hop', res.data)
+
+    #Test 14
+    def test_artists_genre_filter_follows_updates(self):
+        self.client().get('/artists?genre=Jazz')
+        with self.app.app_context():
+            artist = Artist.query.get(self.artist_ids[0])
+            artist.genres = ['Soul']
+            db.session.commit()
+
+        res = self.client().get('/artists?genre=Soul')
+        self.assertIn(b'Artist 0', res.data)
+        self.assertNotIn(b'Artist 1', res.data)
+
+        res = self.client().get('/artists?genre=Jazz')
+        self.assertNotIn(b'Artist 0', res.data)
+        self.assertIn(b'Artist 1', res.data)
+
+    #Test 15
+    def test_400_genre_filter_bad_match(self):
+        res = self.client().get('/artists?genre=Jazz&match=some')
+
+        self.assertEqual(res.status_code, 400)
+
+
+    #Test 16
+    def test_show_counters_follow_inserts_and_deletes(self):
+        self.assertEqual(self.counts(Venue, self.venue_id), (3, 3))
+        self.assertEqual(self.counts(Artist, self.artist_ids[0]), (1, 1))
+
+        with self.app.app_context():
+            show = Show(self.venue_id, self.artist_ids[0],
+                        datetime.now() + timedelta(days=30))
+            show.insert()
+            show_id = show.id
+        self.assertEqual(self.counts(Venue, self.venue_id), (4, 3))
+        self.assertEqual(self.counts(Artist, self.artist_ids[0]), (2, 1))
+
+        with self.app.app_context():
+            show = Show.query.get(show_id)
+            show.start_time = datetime.now() - timedelta(days=30)
+            show.update()
+        self.assertEqual(self.counts(Venue, self.venue_id), (3, 4))
+
+        with self.app.app_context():
+            Show.query.get(show_id).delete()
+        self.assertEqual(self.counts(Venue, self.venue_id), (3, 3))
+        self.assertEqual(self.counts(Artist, self.artist_ids[0]), (1, 1))
+
+    #Test 17
+    def test_rollover_moves_started_shows(self):
+        with self.app.app_context():
+            changed = rollover_shows(datetime.now() + timedelta(days=2))
+            unchanged = rollover_shows(datetime.now() + timedelta(days=2))
+
+        # the shows one and two days ahead have started by then
+        self.assertEqual(changed, 3)
+        self.assertEqual(unchanged, 0)
+        self.assertEqual(self.counts(Venue, self.venue_id), (1, 5))
+        self.assertEqual(self.counts(Artist, self.artist_ids[0]), (0, 2))
+        self.assertEqual(self.counts(Artist, self.artist_ids[2]), (1, 1))
+
+    #Test 18
+    def test_rollover_command_full_recount(self):
+        with self.app.app_context():
+            Venue.query.get(self.venue_id).upcoming_shows_count = 10
+            db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(
+            args=['fyyur', 'rollover', '--full'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('4 venues and artists updated', result.output)
+        self.assertEqual(self.counts(Venue, self.venue_id), (3, 3))
+
+    #Test 19
+    def test_venues_reads_counters(self):
+        res = self.client().get('/venues')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(self.statements), 1)
+        self.assertNotRegex(self.statements[0], r'\bshow\b')
+
+
+    #Test 20
+    def test_show_venue_cached_until_show_added(self):
+        first = self.client().get('/venues/{}'.format(self.venue_id))
+        self.statements = []
+        second = self.client().get('/venues/{}'.format(self.venue_id))
+
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(len(self.statements), 0)
+
+        with self.app.app_context():
+            Show(self.venue_id, self.artist_ids[0],
+                 datetime.now() + timedelta(days=30)).insert()
+        self.statements = []
+        res = self.client().get('/venues/{}'.format(self.venue_id))
+
+        self.assertIn(b'4 Upcoming Shows', res.data)
+        self.assertEqual(len(self.statements), 2)
+
+    #Test 21
+    def test_show_venue_cache_follows_artist_update(self):
+        self.client().get('/venues/{}'.format(self.venue_id))
+        with self.app.app_context():
+            artist = Artist.query.get(self.artist_ids[0])
+            artist.name = 'Renamed Artist'
+            artist.update()
+
+        res = self.client().get('/venues/{}'.format(self.venue_id))
+
+        self.assertIn(b'Renamed Artist', res.data)
+
+    #Test 22
+    def test_disk_fragment_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FragmentCache(DiskBackend(directory), 300)
+            # a second process sees the same files
+            other = FragmentCache(DiskBackend(directory), 300)
+            renders = []
+
+            def render():
+                renders.append(1)
+                return {'title': 'Venue',
+                        'content': '<h1>fragment {}</h1>\n'.format(
+                            len(renders))}
+
+            first = {'title': 'Venue', 'content': '<h1>fragment 1</h1>\n'}
+            self.assertEqual(cache.fetch(('venue', 1), ('venue',), render),
+                             first)
+            self.assertEqual(other.fetch(('venue', 1), ('venue',), render),
+                             first)
+            other.bump('venue')
+            self.assertEqual(cache.fetch(('venue', 1), ('venue',), render)[
+                'content'], '<h1>fragment 2</h1>\n')
+            self.assertEqual(len(renders), 2)
+            self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+            for name in os.listdir(os.path.join(directory, 'entries')):
+                with open(os.path.join(directory, 'entries', name)) as entry:
+                    self.assertEqual(entry.readline()[0], '{')
+        finally:
+            shutil.rmtree(directory)
+
+
+    #Test 23
+    def test_metrics_shards_bounded_on_threaded_server(self):
+        server = make_server('127.0.0.1', 0, self.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+        try:
+            body = urlopen(base_url + '/metrics').read()
+            before = requests_served(body.decode('utf-8'))
+            for _ in range(50):
+                urlopen('{}/venues/{}'.format(base_url, self.venue_id)).read()
+            body = urlopen(base_url + '/metrics').read()
+        finally:
+            server.shutdown()
+
+        # one thread per request, yet only live threads keep a shard
+        self.assertLess(len(metrics._shards), 10)
+        self.assertEqual(requests_served(body.decode('utf-8')) - before, 50)
+
+    #Test 24
+    def test_shows_one_day_window(self):
+        day = datetime.now() + timedelta(days=30)
+        with self.app.app_context():
+            self.add_show(self.venue_id, self.artist_ids[0],
+                          day.replace(hour=20, minute=0))
+            db.session.commit()
+        date = day.strftime('%Y-%m-%d')
+
+        res = self.client().get('/shows?from={0}&to={0}'.format(date))
+        self.assertEqual(res.data.count(b'tile-show'), 1)
+
+        res = self.client().get('/shows?from={0}&to={0} 19:00'.format(date))
+        self.assertEqual(res.data.count(b'tile-show'), 0)
+
+    #Test 25
+    def test_bulk_insert(self):
+        rows = [{'name': 'Bulk Venue {}'.format(i), 'genres': ['Jazz'],
+                 'city': 'Austin', 'state': 'TX'} for i in range(25)]
+        with self.app.app_context():
+            Venue.BULK_CHUNK_SIZE = 10
+            try:
+                count = Venue.bulk_insert(rows)
+            finally:
+                del Venue.BULK_CHUNK_SIZE
+            stored = Venue.query.filter(Venue.name.like('Bulk Venue %')).count()
+
+        self.assertEqual(count, 25)
+        self.assertEqual(stored, 25)
+
+    #Test 26
+    def test_bulk_update(self):
+        with self.app.app_context():
+            count = Artist.bulk_update({
+                artist_id: {'city': 'Boston', 'state': 'MA'}
+                for artist_id in self.artist_ids[:2]})
+            cities = [Artist.query.get(artist_id).city
+                      for artist_id in self.artist_ids]
+
+        self.assertEqual(count, 2)
+        self.assertEqual(cities, ['Boston', 'Boston', 'San Francisco'])
+
+    #Test 27
+    def test_bulk_delete_cascades_to_shows(self):
+        with self.app.app_context():
+            other_id = self.add_venue('The Other Venue')
+            self.add_show(other_id, self.artist_ids[0],
+                          datetime.now() + timedelta(days=5))
+            db.session.commit()
+
+            count = Venue.bulk_delete([self.venue_id])
+            venues = Venue.query.count()
+            shows = [(show.venue_id, show.artist_id)
+                     for show in Show.query.all()]
+
+        self.assertEqual(count, 1)
+        self.assertEqual(venues, 1)
+        self.assertEqual(shows, [(other_id, self.artist_ids[0])])
+        self.assertEqual(self.counts(Artist, self.artist_ids[0]), (1, 0))
+        self.assertEqual(self.counts(Artist, self.artist_ids[1]), (0, 0))
+
+    #Test 28
+    def test_bulk_show_writes_recount_only_their_parents(self):
+        with self.app.app_context():
+            other_id = self.add_venue('The Other Venue')
+            # a stale count that only a recount of this venue would fix
+            Venue.query.get(other_id).upcoming_shows_count = 99
+            db.session.commit()
+
+            Show.bulk_insert([{
+                'venue_id': self.venue_id, 'artist_id': self.artist_ids[1],
+                'start_time': datetime.now() + timedelta(days=day)}
+                for day in (10, 11)])
+        self.assertEqual(self.counts(Venue, self.venue_id), (5, 3))
+        self.assertEqual(self.counts(Artist, self.artist_ids[1]), (3, 1))
+        self.assertEqual(self.counts(Venue, other_id), (99, 0))
+
+        with self.app.app_context():
+            show_ids = [show.id for show in Show.query.filter_by(
+                artist_id=self.artist_ids[1])]
+            Show.bulk_update({show_id: {'artist_id': self.artist_ids[2]}
+                              for show_id in show_ids})
+        self.assertEqual(self.counts(Artist, self.artist_ids[1]), (0, 0))
+        self.assertEqual(self.counts(Artist, self.artist_ids[2]), (4, 2))
+
+        with self.app.app_context():
+            Show.bulk_delete(show_ids)
+        self.assertEqual(self.counts(Venue, self.venue_id), (2, 2))
+        self.assertEqual(self.counts(Artist, self.artist_ids[2]), (1, 1))
+
+    #Test 29
+    def test_artist_search_count_covers_all_pages(self):
+        with self.app.test_request_context():
+            first = search_artist_page('artist', limit=2)
+            second = search_artist_page('artist', first['next_after_id'],
+                                        limit=2)
+        self.assertEqual(first['count'], 3)
+        self.assertEqual(len(first['data']), 2)
+        self.assertEqual(second['count'], 3)
+        self.assertEqual([artist['id'] for artist in second['data']],
+                         [self.artist_ids[2]])
+        self.assertIsNone(second['next_after_id'])
+
+    #Test 30
+    def test_import_loads_valid_rows(self):
+        output = self.run_import('artists', 'artists.csv', (
+            'name,city,state,genres,facebook_link\n'
+            'Imported Artist,Oakland,CA,"Jazz, Blues",'
+            'https://www.facebook.com/imported\n'))
+
+        self.assertIn('1 artists loaded, 0 rejected', output)
+        with self.app.app_context():
+            artist = Artist.query.filter_by(name='Imported Artist').one()
+            self.assertEqual(artist.city, 'Oakland')
+            self.assertEqual(sorted(artist.genres), ['Blues', 'Jazz'])
+
+    #Test 31
+    def test_import_reports_rejected_rows_by_line(self):
+        output = self.run_import('artists', 'artists.csv', (
+            'name,city,state,genres,facebook_link\n'
+            'Good Artist,Oakland,CA,Jazz,https://www.facebook.com/good\n'
+            'No City,,CA,Jazz,https://www.facebook.com/nocity\n'))
+
+        self.assertRegex(output, r'artists\.csv:3: city: ')
+        self.assertIn('1 artists loaded, 1 rejected', output)
+        with self.app.app_context():
+            self.assertEqual(Artist.query.filter_by(name='No City').count(), 0)
+
+    #Test 32
+    def test_import_resolves_shows_by_name(self):
+        output = self.run_import('shows', 'shows.ndjson', json.dumps({
+            'venue_name': 'The Musical Hop', 'artist_name': 'Artist 1',
+            'start_time': '2035-05-21T21:30:00'}) + '\n')
+
+        self.assertIn('1 shows loaded, 0 rejected', output)
+        with self.app.app_context():
+            show = Show.query.filter_by(
+                start_time=datetime(2035, 5, 21, 21, 30)).one()
+            self.assertEqual((show.venue_id, show.artist_id),
+                             (self.venue_id, self.artist_ids[1]))
+        self.assertEqual(self.counts(Artist, self.artist_ids[1]), (2, 1))
+
+    #Test 33
+    def test_import_rejects_unknown_ids(self):
+        output = self.run_import('shows', 'shows.ndjson', json.dumps({
+            'venue_id': 9999, 'artist_id': self.artist_ids[0],
+            'start_time': '2035-05-21 21:30:00'}) + '\n')
+
+        self.assertIn('shows.ndjson:1: unknown venue_id 9999', output)
+        self.assertIn('0 shows loaded, 1 rejected', output)
+
+    #Test 34
+    def test_shows_without_start_time_count_as_past(self):
+        with self.app.app_context():
+            self.add_show(self.venue_id, self.artist_ids[0], None)
+            db.session.commit()
+            past, upcoming = partition_shows(
+                Venue.query.get(self.venue_id).shows)
+        self.assertIsNone(past[0].start_time)
+        self.assertEqual(len(past), 4)
+        self.assertEqual(len(upcoming), 3)
+        self.assertEqual(self.counts(Venue, self.venue_id), (3, 4))
+
+        res = self.client().get('/venues/{}'.format(self.venue_id))
+        self.assertEqual(res.status_code, 200)
+
+    #Test 35
+    def test_shows_pages_skip_shows_without_start_time(self):
+        with self.app.app_context():
+            self.add_show(self.venue_id, self.artist_ids[0], None)
+            db.session.commit()
+        self.app.config['SHOWS_PER_PAGE'] = 1
+        try:
+            tiles, url = 0, '/shows'
+            while url:
+                res = self.client().get(url)
+                self.assertEqual(res.status_code, 200)
+                tiles += res.data.count(b'tile-show')
+                cursor = re.search(rb'after=([^"&]+)', res.data)
+                url = cursor and '/shows?after={}'.format(
+                    cursor.group(1).decode())
+        finally:
+            self.app.config['SHOWS_PER_PAGE'] = 30
+        self.assertEqual(tiles, 6)
+
+    #Test 36
+    def test_disk_fragment_cache_keeps_recent_entries(self):
+        directory = tempfile.mkdtemp()
+        try:
+            backend = DiskBackend(directory, size=2)
+            cache = FragmentCache(backend, 300)
+
+            def render():
+                return {'title': 'Venue', 'content': '<h1>fragment</h1>'}
+
+            for stamp, venue_id in enumerate((1, 2, 1, 3)):
+                cache.fetch(('venue', venue_id), ('venue',), render)
+                # explicit mtimes, filesystems differ in their resolution
+                os.utime(backend._entry_path(('venue', venue_id)),
+                         (stamp, stamp))
+
+            self.assertEqual(len(os.listdir(backend.entries)), 2)
+            self.assertIsNotNone(backend.get(('venue', 1)))
+            self.assertIsNone(backend.get(('venue', 2)))
+            self.assertIsNotNone(backend.get(('venue', 3)))
+
+            for _ in range(3):
+                cache.bump('venue')
+            self.assertEqual(backend.version('venue'), 3)
+            with open(os.path.join(backend.versions, 'venue')) as versions:
+                self.assertEqual(versions.read(), '3')
+        finally:
+            shutil.rmtree(directory)
+
+    #Test 37
+    def test_unknown_genres_do_not_make_cache_keys(self):
+        for genre in ('Nonsense 1', 'Nonsense 2'):
+            res = self.client().get('/venues?genre=Jazz&genre=' + genre)
+            self.assertEqual(res.status_code, 200)
+            res = self.client().get('/artists?genre=' + genre)
+            self.assertEqual(res.status_code, 200)
+
+        keys = list(fragment_cache.backend._entries)
+        self.assertIn(('venues', ('Jazz',), 'all'), keys)
+        self.assertIn(('artists', (), 'all'), keys)
+        self.assertFalse([key for key in keys if 'Nonsense' in repr(key)])
+
+
+def requests_served(body):
+    prefix = 'http_request_duration_seconds_count{endpoint="show_venue"} '
+    for line in body.splitlines():
+        if line.startswith(prefix):
+            return int(line[len(prefix):])
+    return 0
+
+
+def tearDownModule():
+    os.remove(database_file)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+'''
+Throughput of bulk writes next to the per-row model methods.
+
+Seeds a throw-away SQLite database and times inserting, updating and
+deleting the same number of questions through Question.insert() / update() /
+delete() (one commit per row) and through the BulkMixin class methods
+(one statement and commit per chunk).
+
+    python -m benchmarks.bulk_ops --rows 5000
+'''
+import argparse
+import os
+import tempfile
+import time
+
+from flaskr import create_app
+from models import db, Question
+
+
+def question_rows(count, offset=0):
+    return [{
+        'question': 'Question {}'.format(offset + i),
+        'answer': 'Answer {}'.format(offset + i),
+        'category': str(i % 6 + 1),
+        'difficulty': i % 5 + 1,
+    } for i in range(count)]
+
+
+def per_row_insert(rows):
+    for row in rows:
+        Question(**row).insert()
+
+
+def per_row_update(ids):
+    for question_id in ids:
+        question = Question.query.get(question_id)
+        question.difficulty = 5
+        question.update()
+
+
+def per_row_delete(ids):
+    for question_id in ids:
+        Question.query.get(question_id).delete()
+
+
+def rows_per_second(func, count):
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+
+def question_ids():
+    return [row[0] for row in db.session.query(Question.id)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    app = create_app({'DATABASE_PATH': 'sqlite:///{}'.format(path)})
+    try:
+        with app.app_context():
+            results = []
+
+            rows = question_rows(args.rows)
+            single = rows_per_second(lambda: per_row_insert(rows), args.rows)
+            rows = question_rows(args.rows, offset=args.rows)
+            bulk = rows_per_second(lambda: Question.bulk_insert(rows),
+                                   args.rows)
+            results.append(('insert', single, bulk))
+
+            ids = question_ids()
+            single_ids, bulk_ids = ids[:args.rows], ids[args.rows:]
+            single = rows_per_second(lambda: per_row_update(single_ids),
+                                     args.rows)
+            mapping = {question_id: {'difficulty': 5}
+                       for question_id in bulk_ids}
+            bulk = rows_per_second(lambda: Question.bulk_update(mapping),
+                                   args.rows)
+            results.append(('update', single, bulk))
+
+            single = rows_per_second(lambda: per_row_delete(single_ids),
+                                     args.rows)
+            bulk = rows_per_second(lambda: Question.bulk_delete(bulk_ids),
+                                   args.rows)
+            results.append(('delete', single, bulk))
+
+            print('{:>10} {:>16} {:>16}'.format(
+                'operation', 'per row (rows/s)', 'bulk (rows/s)'))
+            for operation, single, bulk in results:
+                print('{:>10} {:>16.0f} {:>16.0f}'.format(
+                    operation, single, bulk))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
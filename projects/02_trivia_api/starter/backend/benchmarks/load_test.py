@@ -0,0 +1,260 @@
+'''
+Throughput and latency of the main trivia endpoints under concurrent load.
+
+Seeds questions and categories into a database (a throw-away SQLite file
+unless --database is given), serves the app on a local port with a threaded
+server, and drives it with --clients concurrent HTTP clients:
+
+  questions           GET /questions?page=n
+  category_questions  GET /categories/<id>/questions
+  search              POST /questions with a searchTerm
+  quizzes             POST /quizzes with up to 20 previous questions
+
+Results (requests/s, mean and p50/p95/p99/max latency, errors) are printed
+and written to --output as JSON, to compare between releases.
+
+    python -m benchmarks.load_test --questions 20000 --clients 8
+    python -m benchmarks.load_test --database postgresql://localhost/trivia_bench --reset
+'''
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import sqlalchemy
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from models import db, Question, Category
+
+WORDS = ['title', 'river', 'painter', 'country', 'world', 'largest',
+         'first', 'team', 'movie', 'element', 'planet', 'author']
+
+
+def seed(questions, categories):
+    Category.bulk_insert([{'type': 'Category {}'.format(i + 1)}
+                          for i in range(categories)])
+    category_ids = [row[0] for row in db.session.query(Category.id)]
+    Question.bulk_insert({
+        'question': 'Which {} {} number {}?'.format(
+            random.choice(WORDS), random.choice(WORDS), i),
+        'answer': 'Answer {}'.format(i),
+        'category': str(category_ids[i % len(category_ids)]),
+        'difficulty': i % 5 + 1,
+    } for i in range(questions))
+    return category_ids
+
+
+def scenarios(category_ids, questions):
+    pages = max(questions // 10, 1)
+
+    def question_page():
+        return 'GET', '/questions?page={}'.format(random.randint(1, pages)), \
+            None
+
+    def category_questions():
+        return 'GET', '/categories/{}/questions'.format(
+            random.choice(category_ids)), None
+
+    def search():
+        return 'POST', '/questions', {'searchTerm': random.choice(WORDS)}
+
+    def quiz():
+        category = random.choice(category_ids + [0])
+        previous = random.sample(range(1, questions + 1),
+                                 min(random.randint(0, 20), questions))
+        return 'POST', '/quizzes', {
+            'quiz_category': {'id': category, 'type': ''},
+            'previous_questions': previous,
+        }
+
+    return [
+        ('questions', question_page),
+        ('category_questions', category_questions),
+        ('search', search),
+        ('quizzes', quiz),
+    ]
+
+
+def send(base_url, method, path, body):
+    data = None
+    headers = {}
+    if body is not None:
+        data = json.dumps(body).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    request = Request(base_url + path, data=data, method=method,
+                      headers=headers)
+    start = time.perf_counter()
+    try:
+        with urlopen(request) as response:
+            response.read()
+            status = response.status
+    except HTTPError as error:
+        error.read()
+        status = error.code
+    return time.perf_counter() - start, status
+
+
+def run_scenario(base_url, make_request, clients, requests):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(count):
+        timings, failed = [], []
+        for _ in range(count):
+            duration, status = send(base_url, *make_request())
+            timings.append(duration)
+            if status >= 500:
+                failed.append(status)
+        with lock:
+            latencies.extend(timings)
+            errors.extend(failed)
+
+    shares = [requests // clients + (1 if i < requests % clients else 0)
+              for i in range(clients)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client, shares))
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed)
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    to_ms = 1000.0
+    return {
+        'requests': len(ordered),
+        'errors': len(errors),
+        'seconds': round(elapsed, 4),
+        'requests_per_second': round(len(ordered) / elapsed, 2)
+        if elapsed else 0.0,
+        'latency_ms': {
+            'mean': round(sum(ordered) / len(ordered) * to_ms, 3)
+            if ordered else 0.0,
+            'p50': round(percentile(ordered, 0.50) * to_ms, 3),
+            'p95': round(percentile(ordered, 0.95) * to_ms, 3),
+            'p99': round(percentile(ordered, 0.99) * to_ms, 3),
+            'max': round(ordered[-1] * to_ms, 3) if ordered else 0.0,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--database',
+                        help='database URI (default: a temporary SQLite file)')
+    parser.add_argument('--reset', action='store_true',
+                        help='drop and recreate the tables of --database')
+    parser.add_argument('--questions', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=6)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per scenario, split over the clients')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='untimed requests per scenario')
+    parser.add_argument('--scenario', action='append',
+                        help='run only this scenario (repeatable)')
+    parser.add_argument('--output', default='load_test_results.json')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    path = None
+    database = args.database
+    if database is None:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        database = 'sqlite:///{}'.format(path)
+
+    app = create_app({'DATABASE_PATH': database})
+    server = None
+    try:
+        with app.app_context():
+            if args.reset:
+                db.drop_all()
+                db.create_all()
+            elif Question.query.first() is not None:
+                sys.exit('{} already holds questions, pass --reset to '
+                         'empty it first'.format(database))
+            app.extensions['search_backend'].install()
+            start = time.perf_counter()
+            category_ids = seed(args.questions, args.categories)
+            seeded = time.perf_counter() - start
+            dialect = db.engine.dialect.name
+
+        # the per-request access log would dominate the timings
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+
+        results = {}
+        print('{:<20} {:>9} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(
+            'scenario', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms',
+            'errors'))
+        for name, make_request in scenarios(category_ids, args.questions):
+            if args.scenario and name not in args.scenario:
+                continue
+            for _ in range(args.warmup):
+                send(base_url, *make_request())
+            result = run_scenario(base_url, make_request, args.clients,
+                                  args.requests)
+            results[name] = result
+            latency = result['latency_ms']
+            print('{:<20} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} '
+                  '{:>7}'.format(name, result['requests_per_second'],
+                                 latency['p50'], latency['p95'],
+                                 latency['p99'], latency['max'],
+                                 result['errors']))
+
+        report = {
+            'created_at': datetime.utcnow().isoformat() + 'Z',
+            'config': {
+                'database': dialect,
+                'questions': args.questions,
+                'categories': args.categories,
+                'clients': args.clients,
+                'requests': args.requests,
+                'warmup': args.warmup,
+                'seed': args.seed,
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'sqlalchemy': sqlalchemy.__version__,
+                'platform': platform.platform(),
+            },
+            'seed_seconds': round(seeded, 3),
+            'scenarios': results,
+        }
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        print('results written to {}'.format(args.output))
+    finally:
+        if server is not None:
+            server.shutdown()
+        if path is not None:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+Latency of picking a quiz question as the quiz gets longer.
+
+Seeds a throw-away SQLite database and times the question selection used by
+POST /quizzes for growing previous_questions lists, next to the old query
+(NOT IN + fetch every candidate) for comparison.
+
+    python -m benchmarks.quiz_sampler --questions 20000 --repeat 200
+'''
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from flaskr import create_app
+from models import db, Question, quiz_sampler
+
+
+def seed_questions(count, categories=6):
+    db.session.bulk_insert_mappings(Question, [{
+        'question': 'Question {}'.format(i),
+        'answer': 'Answer {}'.format(i),
+        'category': str(i % categories + 1),
+        'difficulty': i % 5 + 1,
+    } for i in range(count)])
+    db.session.commit()
+
+
+def sampler_pick(category, previous):
+    question_id = quiz_sampler.pick(category, previous)
+    if question_id is not None:
+        return Question.query.get(question_id)
+
+
+def legacy_pick(category, previous):
+    query = Question.query.filter(Question.id.notin_(previous))
+    if category is not None:
+        query = query.filter_by(category=category)
+    questions = query.all()
+    if questions:
+        return questions[random.randrange(0, len(questions))]
+
+
+def time_per_call(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--questions', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--previous', type=int, nargs='+',
+                        default=[0, 50, 100, 200, 400, 800])
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    app = create_app({'DATABASE_PATH': 'sqlite:///{}'.format(path)})
+    try:
+        with app.app_context():
+            seed_questions(args.questions)
+            ids = [row[0] for row in db.session.query(Question.id)]
+
+            print('{:>10} {:>14} {:>14}'.format(
+                'previous', 'sampler (ms)', 'legacy (ms)'))
+            for size in args.previous:
+                previous = random.sample(ids, min(size, len(ids)))
+                sampler = time_per_call(
+                    lambda: sampler_pick(None, previous), args.repeat)
+                legacy = time_per_call(
+                    lambda: legacy_pick(None, previous), args.repeat)
+                print('{:>10} {:>14.3f} {:>14.3f}'.format(
+                    size, sampler, legacy))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
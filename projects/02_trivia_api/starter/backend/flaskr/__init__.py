@@ -1,34 +1,73 @@
 import os
-from flask import Flask, request, abort, jsonify
+import json
+from flask import Flask, request, abort, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
 
-from models import setup_db, Question, Category
+from models import setup_db, database_path, db, Question, Category, \
+    question_counter, quiz_sampler, category_cache
+from .search import create_search_backend
+from .metrics import Metrics
 
 QUESTIONS_PER_PAGE = 10
+EXPORT_BATCH_SIZE = 1000
 
 
 def paginate_questions(request, selection):
-    page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
-    return current_questions
+    '''
+    paginate_questions(request, selection)
+        fetches and formats a single page of selection, a query ordered by
+        Question.id. Pages are picked with ?page=n (LIMIT/OFFSET) or, for
+        deep pages, with ?after_id=<last id seen> (keyset) so only the rows
+        returned are read from the database.
+    '''
+    page = max(request.args.get('page', 1, type=int), 1)
+    after_id = request.args.get('after_id', None, type=int)
+    if after_id is not None:
+        selection = selection.filter(Question.id > after_id)
+    else:
+        selection = selection.offset((page - 1) * QUESTIONS_PER_PAGE)
+    questions = selection.limit(QUESTIONS_PER_PAGE).all()
+    return [question.format() for question in questions]
+
+
+def stream_ndjson(selection):
+    '''
+    stream_ndjson(selection)
+        yields one json line per question. Rows are fetched through a
+        server-side cursor EXPORT_BATCH_SIZE at a time, so memory use does
+        not grow with the number of questions exported.
+    '''
+    rows = selection.execution_options(stream_results=True) \
+                    .yield_per(EXPORT_BATCH_SIZE)
+    for question in rows:
+        yield json.dumps(question.format()) + '\n'
 
 
 def get_category_list():
-    categories = {}
-    for category in Category.query.all():
-        categories[category.id] = category.type
-    return categories
+    return category_cache.categories()
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    setup_db(app, app.config.get('DATABASE_PATH', database_path))
+    search_backend = create_search_backend(app, db)
+    search_backend.register(Question.question)
+    app.extensions['search_backend'] = search_backend
+    Metrics(app)
+
+    @app.cli.command('install-search')
+    def install_search():
+        '''
+        flask install-search
+            creates the database objects search relies on (on Postgres the
+            pg_trgm extension and a trigram index on questions.question).
+            Run it once per database, it is not repeated on every start.
+        '''
+        search_backend.install()
     '''
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after
     completing the TODOs
@@ -54,18 +93,19 @@ def create_app(test_config=None):
     '''
     @app.route('/categories')
     def retrieve_categories():
-        categories = Category.query.order_by(Category.id).all()
-        if len(categories) == 0:
+        category_list, etag = category_cache.get()
+        if len(category_list) == 0:
             abort(404)
 
-        category_list = {}
-        for category in categories:
-            category_list[category.id] = category.type
-
-        return jsonify({
-            'success': True,
-            'categories': category_list,
-        })
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = jsonify({
+                'success': True,
+                'categories': category_list,
+            })
+        response.set_etag(etag)
+        return response
 
     '''
     @TODO:
@@ -82,7 +122,7 @@ def create_app(test_config=None):
     '''
     @app.route('/questions', methods=['GET'])
     def retrieve_questions():
-        question_list = Question.query.order_by(Question.id).all()
+        question_list = Question.query.order_by(Question.id)
         current_questions = paginate_questions(request, question_list)
         if len(current_questions) == 0:
             abort(404)
@@ -90,11 +130,22 @@ def create_app(test_config=None):
         return jsonify({
             'success': True,
             'questions': current_questions,
-            'total_questions': len(Question.query.all()),
+            'total_questions': question_counter.total(),
             'categories': get_category_list(),
             'currentCategory': None
         })
 
+    @app.route('/questions/export', methods=['GET'])
+    def export_questions():
+        question_list = Question.query.order_by(Question.id)
+        category_id = request.args.get('category', None, type=int)
+        if category_id is not None:
+            question_list = question_list.filter_by(category=str(category_id))
+
+        return app.response_class(
+            stream_with_context(stream_ndjson(question_list)),
+            mimetype='application/x-ndjson')
+
     '''
     @TODO:
     Create an endpoint to DELETE question using a question ID.
@@ -111,14 +162,14 @@ def create_app(test_config=None):
                 abort(404)
 
             question.delete()
-            question_list = Question.query.order_by(Question.id).all()
+            question_list = Question.query.order_by(Question.id)
             current_questions = paginate_questions(request, question_list)
 
             return jsonify({
                 'success': True,
                 'deleted': question_id,
                 'question': current_questions,
-                'total_questions': len(Question.query.all())
+                'total_questions': question_counter.total()
             })
         except:
             abort(422)
@@ -147,27 +198,28 @@ def create_app(test_config=None):
         try:
             if search:
                 question_list = Question.query.order_by(Question.id).filter(
-                                Question.question.ilike('%{}%'.format(search)))
+                                search_backend.filter(Question.question,
+                                                      search))
                 current_questions = paginate_questions(request, question_list)
 
                 return jsonify({
                     'success': True,
                     'questions': current_questions,
-                    'total_questions': len(question_list.all())
+                    'total_questions': question_list.count()
                 })
             else:
                 question = Question(question=new_question, answer=new_answer,
                                     category=new_category,
                                     difficulty=new_difficulty)
                 question.insert()
-                question_list = Question.query.order_by(Question.id).all()
+                question_list = Question.query.order_by(Question.id)
                 current_questions = paginate_questions(request, question_list)
 
             return jsonify({
                 'success': True,
                 'created': question.id,
                 'questions': current_questions,
-                'total_questions': len(Question.query.all())
+                'total_questions': question_counter.total()
             })
         except:
             abort(422)
@@ -200,7 +252,7 @@ def create_app(test_config=None):
 
         try:
             question_list = Question.query.filter_by(
-                            category=category_id).all()
+                            category=category_id).order_by(Question.id)
             current_questions = paginate_questions(request, question_list)
             if len(current_questions) == 0:
                 abort(404)
@@ -209,7 +261,7 @@ def create_app(test_config=None):
                 'success': True,
                 'current_category': category.type,
                 'questions': current_questions,
-                'total_questions': len(question_list)
+                'total_questions': question_counter.total(category_id)
             })
         except:
             abort(404)
@@ -231,26 +283,24 @@ def create_app(test_config=None):
         quiz_category_id = body['quiz_category']['id']
         previous_questions = body['previous_questions']
         try:
-            if quiz_category_id == 0:
-                questions_query = Question.query.filter(
-                              Question.id.notin_(previous_questions)).all()
-            else:
-                questions_query = Question.query.filter_by(
-                              category=quiz_category_id).filter(
-                              Question.id.notin_(previous_questions)).all()
-
-            len_available_question = len(questions_query)
-            if len_available_question > 0:
-                result = {
-                    'success': True,
-                    'question': Question.format(questions_query[
-                                random.randrange(0, len_available_question)])
-                }
-            else:
-                result = {
-                    'success': True,
-                    'question': None
-                }
+            category = None if quiz_category_id == 0 else quiz_category_id
+            question = None
+            question_id = quiz_sampler.pick(category, previous_questions)
+            if question_id is not None:
+                question = Question.query.get(question_id)
+                if question is None:
+                    # the cached ids are stale, e.g. the row was deleted
+                    # by another process
+                    quiz_sampler.invalidate()
+                    question_id = quiz_sampler.pick(category,
+                                                    previous_questions)
+                    if question_id is not None:
+                        question = Question.query.get(question_id)
+
+            result = {
+                'success': True,
+                'question': question.format() if question else None
+            }
             return jsonify(result)
         except:
             abort(404)
@@ -0,0 +1,387 @@
+'''
+Per-request instrumentation.
+
+Counts the SQL statements each request runs and the time spent in them,
+through SQLAlchemy's before/after_cursor_execute events, and records the
+latency, status code and concurrency of every request per endpoint.
+
+  - every response gets a Server-Timing header (db time, statement count,
+    slowest statement), which browser dev tools display next to the request
+  - totals per endpoint are served in Prometheus text format at /metrics:
+    latency histograms with p50/p95/p99 estimates, responses by status
+    code, requests in flight and the SQL totals
+  - requests running more than METRICS_N_PLUS_ONE_THRESHOLD statements are
+    logged as warnings together with their slowest statements
+
+Request threads only ever write to their own Shard, so recording takes no
+lock; /metrics adds the shards up when it is scraped. Servers like
+werkzeug's threaded one start a thread per request, so the shards of
+threads that have ended are folded into a single retired Shard.
+
+    metrics = Metrics(app)
+'''
+import heapq
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Metrics(object):
+    def __init__(self, app=None):
+        self.buckets = DEFAULT_BUCKETS
+        self._shards = []
+        self._retired = Shard()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENDPOINT', '/metrics')
+        app.config.setdefault('METRICS_N_PLUS_ONE_THRESHOLD', 20)
+        app.config.setdefault('METRICS_SLOWEST_STATEMENTS', 3)
+        app.config.setdefault('METRICS_LATENCY_BUCKETS', DEFAULT_BUCKETS)
+        # read once here, request hooks run too often to go through config
+        self.buckets = tuple(sorted(app.config['METRICS_LATENCY_BUCKETS']))
+        self.threshold = app.config['METRICS_N_PLUS_ONE_THRESHOLD']
+        self.keep = app.config['METRICS_SLOWEST_STATEMENTS']
+        app.extensions['metrics'] = self
+        install_listeners()
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule(app.config['METRICS_ENDPOINT'], 'metrics',
+                         self.metrics_view)
+
+    def shard(self):
+        '''
+        shard()
+            returns the calling thread's Shard, creating it on first use
+        '''
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = Shard()
+            thread = weakref.ref(threading.current_thread())
+            with self._lock:
+                self._retire_finished()
+                self._shards.append((thread, shard))
+        return shard
+
+    def _retire_finished(self):
+        # with self._lock held. A thread that has ended writes no more, so
+        # its shard can be added into the retired totals and dropped
+        live = []
+        for thread, shard in self._shards:
+            alive = thread()
+            if alive is not None and alive.is_alive():
+                live.append((thread, shard))
+            else:
+                self._retired.absorb(shard)
+        self._shards = live
+
+    def _before_request(self):
+        endpoint = request.endpoint or 'unmatched'
+        g.request_metrics = RequestQueries(endpoint, self.keep)
+        in_flight = self.shard().in_flight
+        in_flight[endpoint] = in_flight.get(endpoint, 0) + 1
+
+    def _teardown_request(self, exception=None):
+        queries = g.pop('request_metrics', None)
+        if queries is not None:
+            self.shard().in_flight[queries.endpoint] -= 1
+
+    def _after_request(self, response):
+        queries = g.get('request_metrics')
+        if queries is None:
+            return response
+        endpoint = queries.endpoint
+        flagged = queries.count > self.threshold
+
+        response.headers.add('Server-Timing', queries.server_timing())
+        shard = self.shard()
+        totals = shard.sql.get(endpoint)
+        if totals is None:
+            totals = shard.sql[endpoint] = EndpointQueries()
+        totals.add(queries, flagged)
+
+        route = shard.routes.get(endpoint)
+        if route is None:
+            route = shard.routes[endpoint] = RouteStats(len(self.buckets))
+        duration = time.perf_counter() - queries.started
+        route.observe(duration, bisect_left(self.buckets, duration),
+                      response.status_code)
+
+        if flagged:
+            current_app.logger.warning(
+                '%s %s ran %d SQL statements (threshold %d), '
+                'possible N+1 query. Slowest: %s',
+                request.method, request.path, queries.count, self.threshold,
+                '; '.join('{:.1f}ms {}'.format(duration * 1000, statement)
+                          for duration, statement in queries.slowest()))
+        return response
+
+    def metrics_view(self):
+        return current_app.response_class(
+            self.render(), mimetype='text/plain; version=0.0.4')
+
+    def render(self):
+        '''
+        render()
+            returns the collected totals in Prometheus text format
+        '''
+        total = Shard()
+        with self._lock:
+            self._retire_finished()
+            total.absorb(self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            total.absorb(shard)
+        routes, in_flight, sql = total.routes, total.in_flight, total.sql
+
+        lines = []
+        self._render_routes(lines, sorted(routes.items()))
+        series(lines, 'http_requests_in_flight', 'gauge',
+               'Requests currently being handled.')
+        for endpoint, count in sorted(in_flight.items()):
+            lines.append(sample('http_requests_in_flight', count,
+                                endpoint=endpoint))
+        for name, kind, help_text, value in SQL_SERIES:
+            series(lines, name, kind, help_text)
+            for endpoint, totals in sorted(sql.items()):
+                lines.append(sample(name, value(totals), endpoint=endpoint))
+        return '\n'.join(lines) + '\n'
+
+    def _render_routes(self, lines, routes):
+        name = 'http_request_duration_seconds'
+        series(lines, name, 'histogram', 'Request latency.')
+        for endpoint, stats in routes:
+            cumulative = 0
+            for bound, count in zip(self.buckets, stats.buckets):
+                cumulative += count
+                lines.append(sample(name + '_bucket', cumulative,
+                                    endpoint=endpoint, le=repr(bound)))
+            lines.append(sample(name + '_bucket', stats.count,
+                                endpoint=endpoint, le='+Inf'))
+            lines.append(sample(name + '_sum', '{:.6f}'.format(stats.sum),
+                                endpoint=endpoint))
+            lines.append(sample(name + '_count', stats.count,
+                                endpoint=endpoint))
+
+        name = 'http_request_duration_quantile_seconds'
+        series(lines, name, 'gauge',
+               'Request latency quantiles estimated from the histogram.')
+        for endpoint, stats in routes:
+            for quantile in QUANTILES:
+                lines.append(sample(
+                    name, '{:.6f}'.format(
+                        stats.quantile(quantile, self.buckets)),
+                    endpoint=endpoint, quantile=repr(quantile)))
+
+        name = 'http_responses_total'
+        series(lines, name, 'counter', 'Responses by status code.')
+        for endpoint, stats in routes:
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(sample(name, count, endpoint=endpoint,
+                                    status=str(status)))
+
+
+class Shard(object):
+    '''
+    The counters written by one thread. Only that thread changes them;
+    readers copy the dicts and add the shards up.
+    '''
+    def __init__(self):
+        self.routes = {}
+        self.in_flight = {}
+        self.sql = {}
+
+    def absorb(self, other):
+        '''
+        absorb(other)
+            adds the counters of another shard to this one
+        '''
+        for endpoint, stats in dict(other.routes).items():
+            self.routes.setdefault(endpoint, RouteStats(
+                len(stats.buckets) - 1)).merge(stats)
+        for endpoint, count in dict(other.in_flight).items():
+            self.in_flight[endpoint] = self.in_flight.get(endpoint, 0) + count
+        for endpoint, totals in dict(other.sql).items():
+            self.sql.setdefault(endpoint, EndpointQueries()).merge(totals)
+
+
+class RouteStats(object):
+    def __init__(self, buckets):
+        self.buckets = [0] * (buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.statuses = {}
+
+    def observe(self, duration, bucket, status):
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.sum += duration
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def merge(self, other):
+        for index, count in enumerate(list(other.buckets)):
+            self.buckets[index] += count
+        self.count += other.count
+        self.sum += other.sum
+        for status, count in dict(other.statuses).items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+    def quantile(self, quantile, bounds):
+        '''
+        quantile(quantile, bounds)
+            estimates a latency quantile by interpolating inside the bucket
+            it falls in, the same way Prometheus' histogram_quantile() does
+        '''
+        if self.count == 0:
+            return 0.0
+        rank = quantile * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(bounds, self.buckets):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        # in the +Inf bucket: the largest finite bound is all we know
+        return bounds[-1] if bounds else 0.0
+
+
+class RequestQueries(object):
+    '''
+    What is known about the request being handled: its endpoint, when it
+    started, and the statements it ran: how many, how long in total, and
+    the `keep` slowest of them.
+    '''
+    def __init__(self, endpoint, keep):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.keep = keep
+        self.count = 0
+        self.duration = 0.0
+        self._slowest = []
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        entry = (duration, self.count, statement)
+        if len(self._slowest) < self.keep:
+            heapq.heappush(self._slowest, entry)
+        elif self.keep:
+            heapq.heappushpop(self._slowest, entry)
+
+    def max_duration(self):
+        return max(self._slowest)[0] if self._slowest else 0.0
+
+    def slowest(self):
+        return [(duration, ' '.join(statement.split()))
+                for duration, _, statement in sorted(self._slowest,
+                                                     reverse=True)]
+
+    def server_timing(self):
+        timing = 'db;dur={:.2f};desc="{} statements"'.format(
+            self.duration * 1000, self.count)
+        if self.count:
+            timing += ', db-slowest;dur={:.2f}'.format(
+                self.max_duration() * 1000)
+        return timing
+
+
+class EndpointQueries(object):
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.duration = 0.0
+        self.slowest = 0.0
+        self.flagged = 0
+
+    def add(self, queries, flagged):
+        self.requests += 1
+        self.statements += queries.count
+        self.duration += queries.duration
+        self.slowest = max(self.slowest, queries.max_duration())
+        if flagged:
+            self.flagged += 1
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.statements += other.statements
+        self.duration += other.duration
+        self.slowest = max(self.slowest, other.slowest)
+        self.flagged += other.flagged
+
+
+SQL_SERIES = [
+    ('sql_requests_total', 'counter',
+     'Requests instrumented for SQL statements.',
+     lambda totals: totals.requests),
+    ('sql_statements_total', 'counter',
+     'SQL statements executed while handling requests.',
+     lambda totals: totals.statements),
+    ('sql_duration_seconds_total', 'counter',
+     'Time spent executing SQL statements.',
+     lambda totals: '{:.6f}'.format(totals.duration)),
+    ('sql_slowest_statement_seconds', 'gauge',
+     'Slowest single SQL statement seen.',
+     lambda totals: '{:.6f}'.format(totals.slowest)),
+    ('sql_n_plus_one_requests_total', 'counter',
+     'Requests that ran more statements than the N+1 threshold.',
+     lambda totals: totals.flagged),
+]
+
+
+def series(lines, name, kind, help_text):
+    lines.append('# HELP {} {}'.format(name, help_text))
+    lines.append('# TYPE {} {}'.format(name, kind))
+
+
+def sample(name, value, **labels):
+    return '{}{{{}}} {}'.format(name, ','.join(
+        '{}="{}"'.format(label, escape_label(labels[label]))
+        for label in sorted(labels)), value)
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+                .replace('\n', '\\n')
+
+
+def install_listeners():
+    # engine listeners are process wide; requests find their own
+    # RequestQueries on flask.g, so one pair serves every app
+    if event.contains(Engine, 'before_cursor_execute',
+                      _before_cursor_execute):
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = conn.info.get('metrics_started')
+    if not started:
+        return
+    started = started.pop()
+    if has_request_context():
+        queries = g.get('request_metrics')
+        if queries is not None:
+            queries.add(statement, time.perf_counter() - started)
@@ -0,0 +1,221 @@
+'''
+Pluggable partial-string search.
+
+A backend turns a search term into a filter clause on a model column, so
+searches compose with the rest of a query (paging, counting, grouping).
+
+  trigram  - case-insensitive ILIKE served by a pg_trgm GIN index (Postgres)
+  memory   - in-process trigram inverted index, for SQLite test databases
+'''
+import threading
+import weakref
+from sqlalchemy import event, inspect, text
+
+
+def create_search_backend(app, db):
+    '''
+    create_search_backend(app, db)
+        returns the backend named by the SEARCH_BACKEND config value. When
+        it is not set the backend is picked from the database dialect.
+    '''
+    name = app.config.get('SEARCH_BACKEND')
+    if not name:
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+        name = 'memory' if uri.startswith('sqlite') else 'trigram'
+    if name not in SEARCH_BACKENDS:
+        raise ValueError('Unknown search backend: {}'.format(name))
+    return SEARCH_BACKENDS[name](db)
+
+
+class SearchBackend(object):
+    def __init__(self, db):
+        self.db = db
+        self.columns = []
+
+    def register(self, column):
+        '''
+        register(column)
+            makes a model column (e.g. Venue.name) searchable
+        '''
+        self.columns.append(column)
+
+    def install(self):
+        '''
+        install()
+            creates whatever database objects the backend relies on
+        '''
+
+    def filter(self, column, term):
+        '''
+        filter(column, term)
+            returns a clause matching rows whose column contains term,
+            ignoring case
+        '''
+        raise NotImplementedError()
+
+
+class TrigramSearchBackend(SearchBackend):
+    def install(self):
+        with self.db.engine.begin() as connection:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            for column in self.columns:
+                connection.execute(text(trigram_index_ddl(column)))
+
+    def filter(self, column, term):
+        pattern = term.replace('\\', '\\\\').replace('%', '\\%') \
+                      .replace('_', '\\_')
+        return column.ilike('%{}%'.format(pattern), escape='\\')
+
+
+def trigram_index_ddl(column):
+    table = column.class_.__table__.name
+    return ('CREATE INDEX IF NOT EXISTS ix_{0}_{1}_trgm ON "{0}" '
+            'USING gin ({1} gin_trgm_ops)').format(table, column.key)
+
+
+class InvertedIndexSearchBackend(SearchBackend):
+    '''
+    Keeps a trigram -> row ids posting list per registered column. Indexes
+    are loaded on first use and then kept current by mapper events, so a
+    search costs one set intersection plus a check of the candidates.
+    Models with a BulkMixin drop the index after each bulk write.
+    '''
+    def __init__(self, db):
+        super(InvertedIndexSearchBackend, self).__init__(db)
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def register(self, column):
+        super(InvertedIndexSearchBackend, self).register(column)
+        watch_column(column).add(self)
+
+    def invalidate(self, column=None):
+        '''
+        invalidate(column=None)
+            drops the index for column (or all of them) so it is reloaded
+            on the next search, e.g. after a bulk write
+        '''
+        with self._lock:
+            if column is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(column, None)
+
+    def filter(self, column, term):
+        key = primary_key(column)
+        with self._lock:
+            ids = self._load(column).search(term)
+        return key.in_(ids)
+
+    def _load(self, column):
+        index = self._indexes.get(column)
+        if index is None:
+            index = TrigramIndex()
+            rows = self.db.session.query(primary_key(column), column)
+            for row_id, value in rows:
+                index.add(row_id, value)
+            self._indexes[column] = index
+        return index
+
+    def _update(self, column, target, value):
+        with self._lock:
+            index = self._indexes.get(column)
+            if index is None:
+                return
+            row_id = getattr(target, primary_key(column).key)
+            index.remove(row_id)
+            if value is not None:
+                index.add(row_id, value)
+
+
+# backends indexing each column. A column's listeners are installed once
+# and forward to the backends still alive, so an app factory creating a
+# backend per app neither stacks listeners on the model nor keeps the
+# indexes of finished apps reachable through them.
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def watch_column(column):
+    '''
+    watch_column(column)
+        returns the weak set of backends kept current with column's writes
+    '''
+    with _watchers_lock:
+        backends = _watchers.get(column)
+        if backends is None:
+            backends = _watchers[column] = weakref.WeakSet()
+            listen_for_writes(column, backends)
+        return backends
+
+
+def listen_for_writes(column, backends):
+    model = column.class_
+
+    def changed(mapper, connection, target):
+        for backend in list(backends):
+            backend._update(column, target, getattr(target, column.key))
+
+    def deleted(mapper, connection, target):
+        for backend in list(backends):
+            backend._update(column, target, None)
+
+    def bulk_changed():
+        for backend in list(backends):
+            backend.invalidate(column)
+
+    event.listen(model, 'after_insert', changed)
+    event.listen(model, 'after_update', changed)
+    event.listen(model, 'after_delete', deleted)
+    # bulk writes skip the mapper events, reload after them instead
+    if hasattr(model, 'on_bulk_change'):
+        model.on_bulk_change(bulk_changed)
+
+
+def primary_key(column):
+    mapper = inspect(column.class_)
+    return getattr(column.class_, mapper.primary_key[0].key)
+
+
+def trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class TrigramIndex(object):
+    def __init__(self):
+        self.documents = {}
+        self.postings = {}
+
+    def add(self, row_id, value):
+        value = (value or '').lower()
+        self.documents[row_id] = value
+        for gram in trigrams(value):
+            self.postings.setdefault(gram, set()).add(row_id)
+
+    def remove(self, row_id):
+        value = self.documents.pop(row_id, None)
+        if value is None:
+            return
+        for gram in trigrams(value):
+            ids = self.postings.get(gram)
+            ids.discard(row_id)
+            if not ids:
+                del self.postings[gram]
+
+    def search(self, term):
+        term = term.lower()
+        grams = trigrams(term)
+        if grams:
+            postings = sorted((self.postings.get(gram, set())
+                               for gram in grams), key=len)
+            candidates = set.intersection(*postings)
+        else:
+            candidates = self.documents
+        return [row_id for row_id in candidates
+                if term in self.documents[row_id]]
+
+
+SEARCH_BACKENDS = {
+    'trigram': TrigramSearchBackend,
+    'memory': InvertedIndexSearchBackend,
+}
@@ -1,5 +1,9 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import time
+import random
+import hashlib
+import threading
+from sqlalchemy import Column, String, Integer, create_engine, func
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -18,12 +22,133 @@ def setup_db(app, database_path=database_path):
     db.app = app
     db.init_app(app)
     db.create_all()
+    question_counter.invalidate()
+    quiz_sampler.invalidate()
+    category_cache.invalidate()
+
+'''
+BulkMixin
+    bulk_insert(rows), bulk_update(mapping) and bulk_delete(ids) write many
+    rows at once: one multi-row statement (or executemany) per chunk of
+    BULK_CHUNK_SIZE rows and one transaction per chunk, instead of a commit
+    per row. Caches that depend on the table subscribe with
+    on_bulk_change(listener). Rows reached through delete-cascading
+    relationships are deleted with their parents.
+    The same mixin is kept in fyyur's starter_code/app.py and the coffee
+    shop's backend/src/database/models.py: change all three together.
+'''
+class BulkMixin:
+  BULK_CHUNK_SIZE = 1000
+
+  @classmethod
+  def bulk_insert(cls, rows):
+    table = cls.__table__
+    count = 0
+    for chunk in chunked(rows, cls.BULK_CHUNK_SIZE):
+      if db.engine.dialect.name == 'postgresql':
+        statement, params = table.insert().values(chunk), None
+      else:
+        # sqlite limits the number of bound parameters per statement
+        statement, params = table.insert(), chunk
+      cls._bulk_commit(lambda: cls.bulk_chunk(
+        'insert', chunk, lambda: db.session.execute(statement, params)))
+      count += len(chunk)
+    cls.after_bulk_change()
+    return count
+
+  @classmethod
+  def bulk_update(cls, mapping):
+    '''
+    bulk_update(mapping)
+        mapping is {id: {column: new value}}
+    '''
+    rows = [dict(values, id=row_id) for row_id, values in mapping.items()]
+    for chunk in chunked(rows, cls.BULK_CHUNK_SIZE):
+      cls._bulk_commit(lambda: cls.bulk_chunk(
+        'update', chunk, lambda: db.session.bulk_update_mappings(cls, chunk)))
+    cls.after_bulk_change()
+    return len(rows)
+
+  @classmethod
+  def bulk_delete(cls, ids):
+    count = 0
+    for chunk in chunked(ids, cls.BULK_CHUNK_SIZE):
+      count += cls._bulk_commit(lambda: cls._bulk_delete_chunk(chunk))
+    cls._after_bulk_delete()
+    return count
+
+  @classmethod
+  def bulk_chunk(cls, kind, chunk, write):
+    '''
+    bulk_chunk(kind, chunk, write)
+        runs write() for one chunk of an 'insert' or 'update' (row dicts)
+        or a 'delete' (ids), inside the chunk's transaction. Models keeping
+        data derived from their rows elsewhere override it to update that
+        data in the same transaction.
+    '''
+    return write()
+
+  @classmethod
+  def on_bulk_change(cls, listener):
+    cls._bulk_listeners = cls.__dict__.get('_bulk_listeners', []) + [listener]
+
+  @classmethod
+  def after_bulk_change(cls):
+    for listener in cls.__dict__.get('_bulk_listeners', []):
+      listener()
+
+  @classmethod
+  def _bulk_cascades(cls):
+    # (child model, foreign key column) of every relationship that
+    # cascades deletes; query deletes skip the ORM cascade
+    cascades = []
+    for relationship in db.inspect(cls).relationships:
+      if relationship.cascade.delete:
+        (_, foreign_key), = relationship.local_remote_pairs
+        cascades.append((relationship.mapper.class_, foreign_key))
+    return cascades
+
+  @classmethod
+  def _bulk_delete_chunk(cls, ids):
+    for child, foreign_key in cls._bulk_cascades():
+      child_ids = [row[0] for row in
+        db.session.query(child.id).filter(foreign_key.in_(ids))]
+      for child_chunk in chunked(child_ids, child.BULK_CHUNK_SIZE):
+        child._bulk_delete_chunk(child_chunk)
+    return cls.bulk_chunk('delete', ids, lambda: cls.query.filter(
+      cls.id.in_(ids)).delete(synchronize_session=False))
+
+  @classmethod
+  def _after_bulk_delete(cls):
+    for child, _ in cls._bulk_cascades():
+      child._after_bulk_delete()
+    cls.after_bulk_change()
+
+  @staticmethod
+  def _bulk_commit(write):
+    try:
+      result = write()
+      db.session.commit()
+      return result
+    except Exception:
+      db.session.rollback()
+      raise
+
+def chunked(rows, size):
+  chunk = []
+  for row in rows:
+    chunk.append(row)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
 
 '''
 Question
 
 '''
-class Question(db.Model):  
+class Question(BulkMixin, db.Model):  
   __tablename__ = 'questions'
 
   id = Column(Integer, primary_key=True)
@@ -39,15 +164,23 @@ class Question(db.Model):
     self.difficulty = difficulty
 
   def insert(self):
+    category = self.category
     db.session.add(self)
     db.session.commit()
+    question_counter.adjust(category, 1)
+    quiz_sampler.invalidate()
   
   def update(self):
     db.session.commit()
+    question_counter.invalidate()
+    quiz_sampler.invalidate()
 
   def delete(self):
+    category = self.category
     db.session.delete(self)
     db.session.commit()
+    question_counter.adjust(category, -1)
+    quiz_sampler.invalidate()
 
   def format(self):
     return {
@@ -58,11 +191,123 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+'''
+QuestionCounter
+    caches SELECT count(*) totals of questions, overall and per category,
+    so endpoints never load the table just to count it. Question.insert()
+    and Question.delete() adjust the cached totals in place; totals older
+    than ttl seconds are counted again, which picks up writes made by
+    other processes.
+'''
+class QuestionCounter:
+  def __init__(self, ttl=60):
+    self.ttl = ttl
+    self._totals = {}
+    self._generation = 0
+    self._lock = threading.Lock()
+
+  def total(self, category=None):
+    key = None if category is None else str(category)
+    with self._lock:
+      entry = self._totals.get(key)
+      if entry is not None and time.monotonic() - entry[1] < self.ttl:
+        return entry[0]
+      generation = self._generation
+
+    counted = time.monotonic()
+    query = db.session.query(func.count(Question.id))
+    if category is not None:
+      query = query.filter(Question.category == category)
+    count = query.scalar()
+
+    with self._lock:
+      # an adjust() made while counting may be missing from count
+      if generation == self._generation:
+        self._totals[key] = (count, counted)
+    return count
+
+  def adjust(self, category, delta):
+    with self._lock:
+      self._generation += 1
+      for key in (None, str(category)):
+        if key in self._totals:
+          count, counted = self._totals[key]
+          self._totals[key] = (count + delta, counted)
+
+  def invalidate(self):
+    with self._lock:
+      self._generation += 1
+      self._totals.clear()
+
+question_counter = QuestionCounter()
+
+'''
+QuizSampler
+    picks a random question id for a quiz from a cached array of ids per
+    category. Previous questions are excluded with a set lookup and a few
+    random draws, so the cost does not grow with the length of the quiz;
+    only when most ids are excluded does it fall back to a scan of the
+    array. The caller fetches just the chosen row. Arrays older than ttl
+    seconds are loaded again, which picks up writes made by other
+    processes.
+'''
+class QuizSampler:
+  def __init__(self, attempts=8, ttl=60):
+    self.attempts = attempts
+    self.ttl = ttl
+    self._ids = {}
+    self._generation = 0
+    self._lock = threading.Lock()
+
+  def ids(self, category=None):
+    key = None if category is None else str(category)
+    with self._lock:
+      entry = self._ids.get(key)
+      if entry is not None and time.monotonic() - entry[1] < self.ttl:
+        return entry[0]
+      generation = self._generation
+
+    loaded = time.monotonic()
+    query = db.session.query(Question.id)
+    if category is not None:
+      query = query.filter(Question.category == category)
+    ids = tuple(row[0] for row in query)
+
+    with self._lock:
+      # an invalidate() made while loading may be missing from ids
+      if generation == self._generation:
+        self._ids[key] = (ids, loaded)
+    return ids
+
+  def pick(self, category=None, previous=()):
+    ids = self.ids(category)
+    if not ids:
+      return None
+    excluded = set(previous)
+    for _ in range(self.attempts):
+      question_id = random.choice(ids)
+      if question_id not in excluded:
+        return question_id
+
+    remaining = [question_id for question_id in ids
+                 if question_id not in excluded]
+    return random.choice(remaining) if remaining else None
+
+  def invalidate(self):
+    with self._lock:
+      self._generation += 1
+      self._ids.clear()
+
+quiz_sampler = QuizSampler()
+
+Question.on_bulk_change(question_counter.invalidate)
+Question.on_bulk_change(quiz_sampler.invalidate)
+
 '''
 Category
 
 '''
-class Category(db.Model):  
+class Category(BulkMixin, db.Model):  
   __tablename__ = 'categories'
 
   id = Column(Integer, primary_key=True)
@@ -71,8 +316,66 @@ class Category(db.Model):
   def __init__(self, type):
     self.type = type
 
+  def insert(self):
+    db.session.add(self)
+    db.session.commit()
+    category_cache.invalidate()
+
+  def update(self):
+    db.session.commit()
+    category_cache.invalidate()
+
+  def delete(self):
+    db.session.delete(self)
+    db.session.commit()
+    category_cache.invalidate()
+
   def format(self):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+CategoryCache
+    process-local copy of the {id: type} category map with a TTL, plus an
+    ETag for it so GET /categories can answer 304 without touching the
+    database. Category.insert/update/delete invalidate it.
+'''
+class CategoryCache:
+  def __init__(self, ttl=300):
+    self.ttl = ttl
+    self._entry = None
+    self._lock = threading.Lock()
+
+  def get(self):
+    '''
+    get()
+        returns a (categories, etag) tuple, loading the map if the cached
+        copy is missing or older than the TTL
+    '''
+    with self._lock:
+      entry = self._entry
+    if entry is not None and time.monotonic() - entry[2] < self.ttl:
+      return entry[0], entry[1]
+
+    categories = {}
+    for category in Category.query.order_by(Category.id).all():
+      categories[category.id] = category.type
+    etag = hashlib.sha1(json.dumps(
+      sorted(categories.items())).encode('utf-8')).hexdigest()
+
+    with self._lock:
+      self._entry = (categories, etag, time.monotonic())
+    return categories, etag
+
+  def categories(self):
+    return self.get()[0]
+
+  def invalidate(self):
+    with self._lock:
+      self._entry = None
+
+category_cache = CategoryCache()
+
+Category.on_bulk_change(category_cache.invalidate)
\ No newline at end of file
@@ -4,7 +4,7 @@ import json
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import setup_db, Question, Category, quiz_sampler
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -173,6 +173,93 @@ class TriviaTestCase(unittest.TestCase):
         
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
+
+    #Test 14
+    def test_get_questions_after_id(self):
+        res = self.client().get('/questions?after_id=10')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['questions']))
+        self.assertTrue(all(q['id'] > 10 for q in data['questions']))
+
+    #Test 15
+    def test_304_get_categories_with_matching_etag(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+        res = self.client().get('/categories',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+
+    #Test 16
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        lines = res.get_data(as_text=True).splitlines()
+        questions = [json.loads(line) for line in lines]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(len(questions))
+        self.assertEqual([q['id'] for q in questions],
+                         sorted(q['id'] for q in questions))
+
+    #Test 17
+    def test_sql_metrics(self):
+        res = self.client().get('/questions')
+        self.assertIn('desc="', res.headers['Server-Timing'])
+
+        res = self.client().get('/metrics')
+        body = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('sql_statements_total{endpoint="retrieve_questions"}',
+                      body)
+
+    #Test 18
+    def test_request_metrics(self):
+        self.client().get('/questions')
+        self.client().patch('/questions/1000')
+
+        res = self.client().get('/metrics')
+        body = res.get_data(as_text=True)
+
+        self.assertIn('http_request_duration_seconds_count'
+                      '{endpoint="retrieve_questions"}', body)
+        self.assertIn('quantile="0.99"', body)
+        self.assertIn('http_requests_in_flight{endpoint="metrics"} 1', body)
+        self.assertRegex(body, r'http_responses_total\{.*status="405"\}')
+
+    #Test 19
+    def test_quiz_picks_question_added_by_another_process(self):
+        quiz = {'quiz_category': {'id': '99', 'type': 'Elsewhere'},
+                'previous_questions': []}
+        res = self.client().post('/quizzes', json=quiz)
+        self.assertIsNone(json.loads(res.data)['question'])
+
+        # written around Question.insert(), so nothing invalidates the
+        # cached ids; the sampler only sees it once they expire
+        question = Question('Which process wrote this?', 'Another one',
+                            '99', 1)
+        with self.app.app_context():
+            self.db.session.add(question)
+            self.db.session.commit()
+            question_id = question.id
+        quiz_sampler.ttl = 0
+        try:
+            res = self.client().post('/quizzes', json=quiz)
+            data = json.loads(res.data)
+        finally:
+            quiz_sampler.ttl = 60
+            with self.app.app_context():
+                self.db.session.query(Question).filter(
+                    Question.id == question_id).delete()
+                self.db.session.commit()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], question_id)
        
 # Make the tests conveniently executable
 if __name__ == "__main__":
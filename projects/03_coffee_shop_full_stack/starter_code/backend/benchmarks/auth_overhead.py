@@ -0,0 +1,82 @@
+'''
+Per-request overhead of @requires_auth, with and without the verified
+token cache.
+
+Signs a token with a throw-away RSA key, serves the matching key set from
+memory, and times a decorated no-op view inside a request context.
+
+    python -m benchmarks.auth_overhead --repeat 2000
+'''
+import argparse
+import base64
+import time
+
+from Crypto.PublicKey import RSA
+from flask import Flask
+from jose import jwt
+
+from src.auth import auth
+from src.auth.jwks import StaticJWKSProvider
+
+
+def b64_uint(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def signed_token(kid='benchmark'):
+    key = RSA.generate(2048)
+    jwks = {'keys': [{
+        'kty': 'RSA',
+        'kid': kid,
+        'use': 'sig',
+        'n': b64_uint(key.n),
+        'e': b64_uint(key.e)
+    }]}
+    token = jwt.encode({
+        'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+        'aud': auth.API_AUDIENCE,
+        'exp': int(time.time()) + 3600,
+        'permissions': ['get:drinks-detail', 'post:drinks']
+    }, key.exportKey('PEM').decode('ascii'), algorithm='RS256',
+        headers={'kid': kid})
+    return token, jwks
+
+
+def time_per_call(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+
+    token, jwks = signed_token()
+    auth.jwks_cache = auth.JWKSCache(StaticJWKSProvider(jwks))
+
+    @auth.requires_auth('post:drinks')
+    def view(payload):
+        return payload
+
+    app = Flask(__name__)
+    headers = {'Authorization': 'Bearer ' + token}
+    with app.test_request_context(headers=headers):
+        view()
+
+        cached = time_per_call(view, args.repeat)
+
+        def uncached():
+            auth.token_cache.clear()
+            view()
+        verified = time_per_call(uncached, args.repeat)
+
+    print('{:<28} {:>10.1f} us'.format('verify + check every call', verified))
+    print('{:<28} {:>10.1f} us'.format('verified token cache hit', cached))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,243 +1,313 @@
-import os
-from flask import Flask, request, jsonify, abort
-from sqlalchemy import exc
-import json
-from flask_cors import CORS
-
-from .database.models import db_drop_and_create_all, setup_db, Drink
-from .auth.auth import AuthError, requires_auth
-
-app = Flask(__name__)
-setup_db(app)
-
-'''
-Set up CORS. Allow '*' for origins. Delete the sample route after
-completing the TODOs
-'''
-cors = CORS(app, resources={r'/*': {'origins': '*'}},
-            supports_credentials=True)
-
-'''
-Use the after_request decorator to set Access-Control-Allow
-'''
-@app.after_request
-def after_request(response):
-    response.headers.add('Access-Control-Allow-Headers',
-                         'Content-Type,Authorization,true')
-    response.headers.add('Access-Control-Allow-Methods',
-                         'GET, PATCH, POST, DELETE, OPTIONS')
-    return response
-
-
-'''
-@TODO uncomment the following line to initialize the datbase
-!! NOTE THIS WILL DROP ALL RECORDS AND START YOUR DB FROM SCRATCH
-!! NOTE THIS MUST BE UNCOMMENTED ON FIRST RUN
-'''
-# db_drop_and_create_all()
-
-# ROUTES
-'''
-@TODO implement endpoint
-    GET /drinks
-        it should be a public endpoint
-        it should contain only the drink.short() data representation
-        returns status code 200 and json {"success": True, "drinks": drinks}
-        where drinks is the list of drinks or appropriate status code
-        indicating reason for failure
-'''
-@app.route('/drinks', methods=['GET'])
-def drinks():
-    drinks_list = Drink.query.order_by(Drink.id).all()
-    drinks = [drink.short() for drink in drinks_list]
-    if len(drinks) == 0:
-        abort(404)
-    return jsonify({
-        'success': True,
-        'drinks': drinks
-    }), 200
-
-
-'''
-@TODO implement endpoint
-    GET /drinks-detail
-        it should require the 'get:drinks-detail' permission
-        it should contain the drink.long() data representation
-        returns status code 200 and json {"success": True, "drinks": drinks}
-        where drinks is the list of drinks or appropriate status code
-        indicating reason for failure
-'''
-@app.route('/drinks-detail', methods=['GET'])
-@requires_auth('get:drinks-detail')
-def drinks_detail(jwt):
-    drinks_list = Drink.query.order_by(Drink.id).all()
-    drinks = [drink.long() for drink in drinks_list]
-    if len(drinks) == 0:
-        abort(404)
-    return jsonify({
-        'success': True,
-        'drinks': drinks
-    })
-
-
-'''
-@TODO implement endpoint
-    POST /drinks
-        it should create a new row in the drinks table
-        it should require the 'post:drinks' permission
-        it should contain the drink.long() data representation
-        returns status code 200 and json {"success": True, "drinks": drink}
-        where drink an array containing only the newly created drink or
-        appropriate status code indicating reason for failure
-'''
-@app.route('/drinks', methods=['POST'])
-@requires_auth('post:drinks')
-def create_new_drink(jwt):
-    body = request.get_json()
-    new_title = body.get('title', None)
-    new_recipe = body.get('recipe', None)
-    if (new_title is None) or (new_recipe is None):
-        abort(422)
-
-    new_drink = Drink(title=new_title, recipe=json.dumps(new_recipe))
-    new_drink.insert()
-
-    drinks_all = Drink.query.all()
-    drinks = [drink.long() for drink in drinks_all]
-    if len(drinks) == 0:
-        abort(404)
-    return jsonify({
-        "success": True,
-        "drinks": drinks,
-      }), 200
-
-
-'''
-@TODO implement endpoint
-    PATCH /drinks/<id>
-        where <id> is the existing model id
-        it should respond with a 404 error if <id> is not found
-        it should update the corresponding row for <id>
-        it should require the 'patch:drinks' permission
-        it should contain the drink.long() data representation
-        returns status code 200 and json {"success": True, "drinks": drink}
-        where drink an array containing only the updated drink or
-        appropriate status code indicating reason for failure
-'''
-@app.route('/drinks/<int:drink_id>', methods=['PATCH'])
-@requires_auth('patch:drinks')
-def update_drink(jwt, drink_id):
-    try:
-        drink = Drink.query.get(drink_id)
-        if drink is None:
-            abort(404)
-        body = request.get_json()
-        drink.title = body.get('title', drink.title)
-        recipe = json.dumps(body.get('recipe'))
-        if recipe != 'null':
-            drink.recipe = recipe
-        drink.update()
-        return jsonify({
-            "success": True,
-            "drinks": [drink.long()]
-        }), 200
-    except Exception:
-        abort(422)
-
-
-'''
-@TODO implement endpoint
-    DELETE /drinks/<id>
-        where <id> is the existing model id
-        it should respond with a 404 error if <id> is not found
-        it should delete the corresponding row for <id>
-        it should require the 'delete:drinks' permission
-        returns status code 200 and json {"success": True, "delete": id}
-        where id is the id of the deleted record or appropriate status code
-        indicating reason for failure
-'''
-@app.route('/drinks/<int:drink_id>', methods=['DELETE'])
-@requires_auth('delete:drinks')
-def delete_drink(jwt, drink_id):
-    try:
-        drink = Drink.query.get(drink_id)
-        if drink is None:
-            abort(404)
-
-        drink.delete()
-        return jsonify({
-            'success': True,
-            'deleted': drink_id
-        })
-    except Exception:
-        abort(422)
-
-
-'''
-@TODO implement error handlers using the @app.errorhandler(error) decorator
-    each error handler should return (with approprate messages):
-             jsonify({
-                    "success": False,
-                    "error": 404,
-                    "message": "resource not found"
-                    }), 404
-
-'''
-@app.errorhandler(400)
-def not_found(error):
-    return jsonify({
-        'success': False,
-        'error': 400,
-        'message': 'Bad Request'
-    }), 400
-
-
-@app.errorhandler(401)
-def not_found(error):
-    return jsonify({
-        'success': False,
-        'error': 401,
-        'message': 'Unauthorized'
-    }), 401
-
-
-'''
-@TODO implement error handler for 404
-error handler should conform to general task above
-'''
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify({
-        'success': False,
-        'error': 404,
-        'message': 'resource not found'
-    }), 404
-
-
-@app.errorhandler(405)
-def not_found(error):
-    return jsonify({
-        'success': False,
-        'error': 405,
-        'message': 'Method not allowed'
-    }), 405
-
-
-@app.errorhandler(422)
-def unprocessable(error):
-    return jsonify({
-        'success': False,
-        'error': 422,
-        'message': 'unprocessable'
-    }), 422
-
-
-'''
-@TODO implement error handler for AuthError
-error handler should conform to general task above
-'''
-@app.errorhandler(AuthError)
-def handle_auth_error(ex):
-    response = jsonify(ex.error)
-    response.status_code = ex.status_code
-    return response
+import os
+from flask import Flask, request, jsonify, abort
+from sqlalchemy import exc
+from flask_cors import CORS
+
+from .database.models import db_drop_and_create_all, setup_db, Drink, \
+    menu_cache, upgrade_recipe_column
+from .auth.auth import AuthError, requires_auth
+from .metrics import Metrics
+
+app = Flask(__name__)
+setup_db(app)
+metrics = Metrics(app)
+
+'''
+Set up CORS. Allow '*' for origins. Delete the sample route after
+completing the TODOs
+'''
+cors = CORS(app, resources={r'/*': {'origins': '*'}},
+            supports_credentials=True)
+
+'''
+Use the after_request decorator to set Access-Control-Allow
+'''
+@app.after_request
+def after_request(response):
+    response.headers.add('Access-Control-Allow-Headers',
+                         'Content-Type,Authorization,true')
+    response.headers.add('Access-Control-Allow-Methods',
+                         'GET, PATCH, POST, DELETE, OPTIONS')
+    return response
+
+
+'''
+@TODO uncomment the following line to initialize the datbase
+!! NOTE THIS WILL DROP ALL RECORDS AND START YOUR DB FROM SCRATCH
+!! NOTE THIS MUST BE UNCOMMENTED ON FIRST RUN
+'''
+# db_drop_and_create_all()
+
+
+'''
+Run `flask upgrade-recipes` once to convert recipes saved by older
+versions of the app (json strings in a String(180) column) to the json
+column type
+'''
+@app.cli.command('upgrade-recipes')
+def upgrade_recipes():
+    upgrade_recipe_column()
+
+# ROUTES
+'''
+@TODO implement endpoint
+    GET /drinks
+        it should be a public endpoint
+        it should contain only the drink.short() data representation
+        returns status code 200 and json {"success": True, "drinks": drinks}
+        where drinks is the list of drinks or appropriate status code
+        indicating reason for failure
+'''
+@app.route('/drinks', methods=['GET'])
+def drinks():
+    body = menu_cache.get('short')
+    if body is None:
+        abort(404)
+    return app.response_class(body, mimetype='application/json'), 200
+
+
+'''
+@TODO implement endpoint
+    GET /drinks-detail
+        it should require the 'get:drinks-detail' permission
+        it should contain the drink.long() data representation
+        returns status code 200 and json {"success": True, "drinks": drinks}
+        where drinks is the list of drinks or appropriate status code
+        indicating reason for failure
+'''
+@app.route('/drinks-detail', methods=['GET'])
+@requires_auth('get:drinks-detail')
+def drinks_detail(jwt):
+    body = menu_cache.get('long')
+    if body is None:
+        abort(404)
+    return app.response_class(body, mimetype='application/json')
+
+
+'''
+@TODO implement endpoint
+    POST /drinks
+        it should create a new row in the drinks table
+        it should require the 'post:drinks' permission
+        it should contain the drink.long() data representation
+        returns status code 200 and json {"success": True, "drinks": drink}
+        where drink an array containing only the newly created drink or
+        appropriate status code indicating reason for failure
+'''
+@app.route('/drinks', methods=['POST'])
+@requires_auth('post:drinks')
+def create_new_drink(jwt):
+    body = request.get_json()
+    # the menu is built from every stored recipe: a malformed one would
+    # break GET /drinks for everybody, so it never gets stored
+    if validate_drink(body) is not None:
+        abort(422)
+
+    new_drink = Drink(title=body['title'], recipe=body['recipe'])
+    new_drink.insert()
+
+    return jsonify({
+        "success": True,
+        "drinks": [new_drink.long()],
+      }), 200
+
+
+'''
+validate_drink(item)
+    returns why item cannot be created as a drink, or None if it can
+'''
+def validate_drink(item):
+    if not isinstance(item, dict):
+        return 'drink must be an object'
+    title = item.get('title')
+    if not isinstance(title, str) or not title.strip():
+        return 'title is required'
+    if len(title) > 80:
+        return 'title must be at most 80 characters'
+    recipe = item.get('recipe')
+    if not isinstance(recipe, list) or len(recipe) == 0:
+        return 'recipe must be a non-empty list'
+    for ingredient in recipe:
+        if not isinstance(ingredient, dict) or \
+                not {'color', 'name', 'parts'} <= set(ingredient):
+            return 'each ingredient needs color, name and parts'
+    return None
+
+
+'''
+POST /drinks/batch
+    creates many drinks in one transaction
+    it should require the 'post:drinks' permission
+    takes json {"drinks": [{"title": ..., "recipe": [...]}, ...]}
+    invalid items (or titles already taken) are reported in "errors" by
+    their index and skipped; the rest are committed together
+    returns status code 200 and json
+    {"success": True, "drinks": [created drink.long()], "errors": [...]}
+'''
+@app.route('/drinks/batch', methods=['POST'])
+@requires_auth('post:drinks')
+def create_drinks_batch(jwt):
+    body = request.get_json()
+    items = body.get('drinks') if isinstance(body, dict) else None
+    if not isinstance(items, list) or len(items) == 0:
+        abort(422)
+
+    titles = [item.get('title') for item in items
+              if validate_drink(item) is None]
+    taken = Drink.existing_titles(titles)
+
+    new_drinks = []
+    errors = []
+    for index, item in enumerate(items):
+        error = validate_drink(item)
+        if error is None and item['title'] in taken:
+            error = 'title already exists'
+        if error is not None:
+            errors.append({'index': index, 'message': error})
+            continue
+        taken.add(item['title'])
+        new_drinks.append(Drink(title=item['title'], recipe=item['recipe']))
+
+    try:
+        drinks = Drink.insert_all(new_drinks)
+    except exc.SQLAlchemyError:
+        abort(422)
+
+    return jsonify({
+        "success": True,
+        "drinks": drinks,
+        "errors": errors,
+      }), 200
+
+
+'''
+@TODO implement endpoint
+    PATCH /drinks/<id>
+        where <id> is the existing model id
+        it should respond with a 404 error if <id> is not found
+        it should update the corresponding row for <id>
+        it should require the 'patch:drinks' permission
+        it should contain the drink.long() data representation
+        returns status code 200 and json {"success": True, "drinks": drink}
+        where drink an array containing only the updated drink or
+        appropriate status code indicating reason for failure
+'''
+@app.route('/drinks/<int:drink_id>', methods=['PATCH'])
+@requires_auth('patch:drinks')
+def update_drink(jwt, drink_id):
+    try:
+        drink = Drink.query.get(drink_id)
+        if drink is None:
+            abort(404)
+        body = request.get_json()
+        title = body.get('title', drink.title)
+        recipe = body.get('recipe', drink.recipe)
+        if validate_drink({'title': title, 'recipe': recipe}) is not None:
+            abort(422)
+        drink.title = title
+        drink.recipe = recipe
+        drink.update()
+        return jsonify({
+            "success": True,
+            "drinks": [drink.long()]
+        }), 200
+    except Exception:
+        abort(422)
+
+
+'''
+@TODO implement endpoint
+    DELETE /drinks/<id>
+        where <id> is the existing model id
+        it should respond with a 404 error if <id> is not found
+        it should delete the corresponding row for <id>
+        it should require the 'delete:drinks' permission
+        returns status code 200 and json {"success": True, "delete": id}
+        where id is the id of the deleted record or appropriate status code
+        indicating reason for failure
+'''
+@app.route('/drinks/<int:drink_id>', methods=['DELETE'])
+@requires_auth('delete:drinks')
+def delete_drink(jwt, drink_id):
+    try:
+        drink = Drink.query.get(drink_id)
+        if drink is None:
+            abort(404)
+
+        drink.delete()
+        return jsonify({
+            'success': True,
+            'deleted': drink_id
+        })
+    except Exception:
+        abort(422)
+
+
+'''
+@TODO implement error handlers using the @app.errorhandler(error) decorator
+    each error handler should return (with approprate messages):
+             jsonify({
+                    "success": False,
+                    "error": 404,
+                    "message": "resource not found"
+                    }), 404
+
+'''
+@app.errorhandler(400)
+def not_found(error):
+    return jsonify({
+        'success': False,
+        'error': 400,
+        'message': 'Bad Request'
+    }), 400
+
+
+@app.errorhandler(401)
+def not_found(error):
+    return jsonify({
+        'success': False,
+        'error': 401,
+        'message': 'Unauthorized'
+    }), 401
+
+
+'''
+@TODO implement error handler for 404
+error handler should conform to general task above
+'''
+@app.errorhandler(404)
+def not_found(error):
+    return jsonify({
+        'success': False,
+        'error': 404,
+        'message': 'resource not found'
+    }), 404
+
+
+@app.errorhandler(405)
+def not_found(error):
+    return jsonify({
+        'success': False,
+        'error': 405,
+        'message': 'Method not allowed'
+    }), 405
+
+
+@app.errorhandler(422)
+def unprocessable(error):
+    return jsonify({
+        'success': False,
+        'error': 422,
+        'message': 'unprocessable'
+    }), 422
+
+
+'''
+@TODO implement error handler for AuthError
+error handler should conform to general task above
+'''
+@app.errorhandler(AuthError)
+def handle_auth_error(ex):
+    response = jsonify(ex.error)
+    response.status_code = ex.status_code
+    return response
@@ -2,12 +2,25 @@ import json
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+import os
+from .auth.jwks import JWKSCache, FileJWKSProvider, UrlJWKSProvider
+from .auth.token_cache import VerifiedTokenCache
 
 AUTH0_DOMAIN = 'check-check.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'coffeeshop'
 
+# Signing keys are cached by kid (see jwks.py). Point JWKS_FILE at a local
+# key set to verify tokens without reaching the identity provider.
+if os.environ.get('JWKS_FILE'):
+    jwks_cache = JWKSCache(FileJWKSProvider(os.environ['JWKS_FILE']))
+else:
+    jwks_cache = JWKSCache(
+        UrlJWKSProvider(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'))
+
+# Tokens that already passed verify_decode_jwt(), until their exp claim
+token_cache = VerifiedTokenCache()
+
 
 # AuthError Exception
 '''
@@ -81,14 +94,16 @@ def get_token_auth_header():
 '''
 
 
-def check_permissions(permission, payload):
-    if 'permissions' not in payload:
-        raise AuthError({
-            'code': 'invalid_claims',
-            'description': 'Permissions not included in JWT'
-        }, 400)
+def check_permissions(permission, payload, permissions=None):
+    if permissions is None:
+        if 'permissions' not in payload:
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Permissions not included in JWT'
+            }, 400)
+        permissions = frozenset(payload['permissions'])
 
-    if permission not in payload['permissions']:
+    if permission not in permissions:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found'
@@ -115,25 +130,14 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_cache.get_key(unverified_header['kid'])
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -185,14 +189,18 @@ def requires_auth(permission=''):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            try:
-                payload = verify_decode_jwt(token)
-            except Exception:
-                raise AuthError({
-                    'code': 'invalid_header',
-                    'description': 'Unauthorized.'
-                }, 401)
-            check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
+            verified = token_cache.get(token)
+            if verified is None:
+                try:
+                    payload = verify_decode_jwt(token)
+                except Exception:
+                    raise AuthError({
+                        'code': 'invalid_header',
+                        'description': 'Unauthorized.'
+                    }, 401)
+                verified = token_cache.put(token, payload)
+            check_permissions(permission, verified.payload,
+                              verified.permissions)
+            return f(verified.payload, *args, **kwargs)
         return wrapper
     return requires_auth_decorator
@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+
+'''
+JWKS providers
+    fetch() returns a parsed JSON Web Key Set ({'keys': [...]}).
+    UrlJWKSProvider reads it from the identity provider, FileJWKSProvider
+    and StaticJWKSProvider let tests run without network access.
+'''
+
+
+class UrlJWKSProvider:
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self):
+        with urlopen(self.url, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+
+class FileJWKSProvider:
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self):
+        with open(self.path) as jwks_file:
+            return json.load(jwks_file)
+
+
+class StaticJWKSProvider:
+    def __init__(self, jwks):
+        self.jwks = jwks
+
+    def fetch(self):
+        return self.jwks
+
+
+'''
+JWKSCache
+    keeps the signing keys of a JWKS provider in memory, keyed by kid.
+
+    - keys younger than ttl are served from memory
+    - keys older than ttl but younger than ttl + stale_ttl are still served
+      while a background thread refreshes the set (stale-while-revalidate)
+    - an unknown kid triggers a synchronous refresh, so key rotation is
+      picked up
+    - keys older than ttl + stale_ttl are refreshed synchronously; if that
+      fails the old keys are still served
+    - concurrent refreshes are collapsed into one fetch (single-flight),
+      and whatever triggers it, a fetch starts at most once every
+      min_refresh_interval seconds, so neither bogus kids nor a down
+      identity provider make every request wait on the network
+'''
+
+
+class JWKSCache:
+    def __init__(self, provider, ttl=600, stale_ttl=3600,
+                 min_refresh_interval=30):
+        self.provider = provider
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._inflight = None
+        self._lock = threading.Lock()
+
+    def get_key(self, kid):
+        '''
+        get_key(kid)
+            returns the RSA key for kid, or None if the provider does not
+            know it
+        '''
+        with self._lock:
+            key = self._keys.get(kid)
+            age = self._age()
+
+        if key is not None:
+            if age >= self.ttl + self.stale_ttl:
+                self.refresh(self.min_refresh_interval)
+                with self._lock:
+                    return self._keys.get(kid)
+            if age >= self.ttl:
+                self._refresh_in_background()
+            return key
+
+        self.refresh(self.min_refresh_interval)
+        with self._lock:
+            return self._keys.get(kid)
+
+    def refresh(self, min_interval=0):
+        '''
+        refresh(min_interval=0)
+            fetches the key set, or waits for a fetch already in flight.
+            Does nothing if the last fetch started less than min_interval
+            seconds ago. A failed fetch keeps the keys we already have.
+        '''
+        with self._lock:
+            inflight = self._inflight
+            if inflight is None:
+                if self._attempted_recently(min_interval):
+                    return
+                self._attempted_at = time.monotonic()
+                inflight = self._inflight = threading.Event()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            inflight.wait()
+            return
+
+        try:
+            keys = parse_keys(self.provider.fetch())
+            with self._lock:
+                self._keys = keys
+                self._fetched_at = time.monotonic()
+        except Exception:
+            with self._lock:
+                if not self._keys:
+                    raise
+        finally:
+            with self._lock:
+                self._inflight = None
+            inflight.set()
+
+    def _attempted_recently(self, interval):
+        return (self._attempted_at is not None and
+                time.monotonic() - self._attempted_at < interval)
+
+    def _age(self):
+        if self._fetched_at is None:
+            return float('inf')
+        return time.monotonic() - self._fetched_at
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._inflight is not None or self._attempted_recently(
+                    self.min_refresh_interval):
+                return
+        thread = threading.Thread(target=self._refresh_quietly)
+        thread.daemon = True
+        thread.start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh(self.min_refresh_interval)
+        except Exception:
+            pass
+
+
+def parse_keys(jwks):
+    keys = {}
+    for key in jwks.get('keys', []):
+        if 'kid' not in key:
+            continue
+        keys[key['kid']] = {
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key.get('use'),
+            'n': key['n'],
+            'e': key['e']
+        }
+    return keys
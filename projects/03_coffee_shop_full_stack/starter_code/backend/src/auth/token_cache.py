@@ -0,0 +1,70 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+'''
+VerifiedToken
+    a decoded jwt payload, its permissions as a frozenset (None when the
+    claim is missing) and the time it stops being valid
+'''
+VerifiedToken = namedtuple('VerifiedToken',
+                           ['payload', 'permissions', 'expires_at'])
+
+
+'''
+VerifiedTokenCache
+    bounded LRU of tokens whose signature and claims were already verified,
+    keyed by a sha256 of the token so raw tokens are not kept around.
+    Entries expire with the token's exp claim; tokens without one are never
+    cached.
+'''
+
+
+class VerifiedTokenCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        key = token_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, token, payload):
+        '''
+        put(token, payload)
+            caches the verified payload and returns it as a VerifiedToken
+        '''
+        permissions = None
+        if 'permissions' in payload:
+            permissions = frozenset(payload['permissions'])
+        expires_at = payload.get('exp')
+        entry = VerifiedToken(payload, permissions, expires_at)
+        if expires_at is None or self.maxsize <= 0:
+            return entry
+
+        key = token_key(token)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def token_key(token):
+    return hashlib.sha256(token.encode('utf-8')).digest()
@@ -1,5 +1,8 @@
 import os
-from sqlalchemy import Column, String, Integer
+import time
+import threading
+from sqlalchemy import Column, String, Integer, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -29,26 +32,162 @@ def db_drop_and_create_all():
     db.drop_all()
     db.create_all()
 
+'''
+upgrade_recipe_column()
+    converts drinks stored with the old String(180) recipe column, which held
+    json.dumps() output, to the json column. On postgres the column type is
+    changed in place; sqlite keeps json as text, so existing rows already
+    read back as json and nothing needs converting.
+'''
+def upgrade_recipe_column():
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(
+            'ALTER TABLE drink ALTER COLUMN recipe TYPE jsonb '
+            'USING recipe::jsonb')
+        db.session.commit()
+
+'''
+BulkMixin
+    bulk_insert(rows), bulk_update(mapping) and bulk_delete(ids) write many
+    rows at once: one multi-row statement (or executemany) per chunk of
+    BULK_CHUNK_SIZE rows and one transaction per chunk, instead of a commit
+    per row. Caches that depend on the table subscribe with
+    on_bulk_change(listener). Rows reached through delete-cascading
+    relationships are deleted with their parents.
+    The same mixin is kept in fyyur's starter_code/app.py and trivia's
+    backend/models.py: change all three together.
+'''
+class BulkMixin:
+    BULK_CHUNK_SIZE = 1000
+
+    @classmethod
+    def bulk_insert(cls, rows):
+        table = cls.__table__
+        count = 0
+        for chunk in chunked(rows, cls.BULK_CHUNK_SIZE):
+            if db.engine.dialect.name == 'postgresql':
+                statement, params = table.insert().values(chunk), None
+            else:
+                # sqlite limits the number of bound parameters per statement
+                statement, params = table.insert(), chunk
+            cls._bulk_commit(lambda: cls.bulk_chunk(
+                'insert', chunk,
+                lambda: db.session.execute(statement, params)))
+            count += len(chunk)
+        cls.after_bulk_change()
+        return count
+
+    '''
+    bulk_update(mapping)
+        mapping is {id: {column: new value}}
+    '''
+    @classmethod
+    def bulk_update(cls, mapping):
+        rows = [dict(values, id=row_id) for row_id, values in mapping.items()]
+        for chunk in chunked(rows, cls.BULK_CHUNK_SIZE):
+            cls._bulk_commit(lambda: cls.bulk_chunk(
+                'update', chunk,
+                lambda: db.session.bulk_update_mappings(cls, chunk)))
+        cls.after_bulk_change()
+        return len(rows)
+
+    @classmethod
+    def bulk_delete(cls, ids):
+        count = 0
+        for chunk in chunked(ids, cls.BULK_CHUNK_SIZE):
+            count += cls._bulk_commit(lambda: cls._bulk_delete_chunk(chunk))
+        cls._after_bulk_delete()
+        return count
+
+    '''
+    bulk_chunk(kind, chunk, write)
+        runs write() for one chunk of an 'insert' or 'update' (row dicts)
+        or a 'delete' (ids), inside the chunk's transaction. Models keeping
+        data derived from their rows elsewhere override it to update that
+        data in the same transaction.
+    '''
+    @classmethod
+    def bulk_chunk(cls, kind, chunk, write):
+        return write()
+
+    @classmethod
+    def on_bulk_change(cls, listener):
+        cls._bulk_listeners = \
+            cls.__dict__.get('_bulk_listeners', []) + [listener]
+
+    @classmethod
+    def after_bulk_change(cls):
+        for listener in cls.__dict__.get('_bulk_listeners', []):
+            listener()
+
+    @classmethod
+    def _bulk_cascades(cls):
+        # (child model, foreign key column) of every relationship that
+        # cascades deletes; query deletes skip the ORM cascade
+        cascades = []
+        for relationship in db.inspect(cls).relationships:
+            if relationship.cascade.delete:
+                (_, foreign_key), = relationship.local_remote_pairs
+                cascades.append((relationship.mapper.class_, foreign_key))
+        return cascades
+
+    @classmethod
+    def _bulk_delete_chunk(cls, ids):
+        for child, foreign_key in cls._bulk_cascades():
+            child_ids = [row[0] for row in db.session.query(child.id).filter(
+                foreign_key.in_(ids))]
+            for child_chunk in chunked(child_ids, child.BULK_CHUNK_SIZE):
+                child._bulk_delete_chunk(child_chunk)
+        return cls.bulk_chunk('delete', ids, lambda: cls.query.filter(
+            cls.id.in_(ids)).delete(synchronize_session=False))
+
+    @classmethod
+    def _after_bulk_delete(cls):
+        for child, _ in cls._bulk_cascades():
+            child._after_bulk_delete()
+        cls.after_bulk_change()
+
+    @staticmethod
+    def _bulk_commit(write):
+        try:
+            result = write()
+            db.session.commit()
+            return result
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 '''
 Drink
 a persistent drink entity, extends the base SQLAlchemy Model
 '''
-class Drink(db.Model):
+class Drink(BulkMixin, db.Model):
     # Autoincrementing, unique primary key
     id = Column(Integer().with_variant(Integer, "sqlite"), primary_key=True)
     # String Title
     title = Column(String(80), unique=True)
-    # the ingredients blob - this stores a lazy json blob
+    # the ingredients, stored as native json (jsonb on postgres)
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
-    recipe =  Column(String(180), nullable=False)
+    recipe = Column(JSON().with_variant(JSONB(), 'postgresql'), nullable=False)
 
     '''
     short()
         short form representation of the Drink model
     '''
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
+        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in self.recipe]
         return {
             'id': self.id,
             'title': self.title,
@@ -63,7 +202,7 @@ class Drink(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': self.recipe
         }
 
     '''
@@ -78,6 +217,40 @@ class Drink(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        menu_cache.invalidate()
+
+    '''
+    insert_all(drinks)
+        inserts many new drinks with a single commit and returns their
+        long() representations (taken before the commit expires them)
+        EXAMPLE
+            Drink.insert_all([Drink(title=t, recipe=r) for t, r in items])
+    '''
+    @staticmethod
+    def insert_all(drinks):
+        if not drinks:
+            return []
+        try:
+            db.session.add_all(drinks)
+            db.session.flush()
+            result = [drink.long() for drink in drinks]
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        menu_cache.invalidate()
+        return result
+
+    '''
+    existing_titles(titles)
+        returns the set of titles that are already on the menu
+    '''
+    @staticmethod
+    def existing_titles(titles):
+        if not titles:
+            return set()
+        rows = db.session.query(Drink.title).filter(Drink.title.in_(titles))
+        return {title for (title,) in rows}
 
     '''
     delete()
@@ -90,6 +263,7 @@ class Drink(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        menu_cache.invalidate()
 
     '''
     update()
@@ -102,6 +276,69 @@ class Drink(db.Model):
     '''
     def update(self):
         db.session.commit()
+        menu_cache.invalidate()
 
     def __repr__(self):
-        return json.dumps(self.short())
\ No newline at end of file
+        return json.dumps(self.short())
+
+
+'''
+MenuCache
+    holds the encoded json bodies of GET /drinks (short) and
+    GET /drinks-detail (long), so reads skip both the database and the
+    per-drink recipe parsing. Drink.insert(), update() and delete()
+    invalidate it after committing; the next read rebuilds both bodies.
+    Writes made by other worker processes are not seen until the bodies
+    are older than ttl seconds and get rebuilt.
+'''
+class MenuCache:
+    def __init__(self, ttl=10):
+        self.ttl = ttl
+        self._bodies = None
+        self._built = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    '''
+    get(representation)
+        returns the response body for 'short' or 'long', or None if there
+        are no drinks on the menu
+    '''
+    def get(self, representation):
+        with self._lock:
+            bodies = self._bodies
+            built = self._built
+            generation = self._generation
+        if bodies is None or time.monotonic() - built >= self.ttl:
+            built = time.monotonic()
+            bodies = self._build()
+            with self._lock:
+                # a write that committed while we were building wins
+                if generation == self._generation:
+                    self._bodies = bodies
+                    self._built = built
+        return bodies.get(representation)
+
+    def invalidate(self):
+        with self._lock:
+            self._bodies = None
+            self._generation += 1
+
+    def _build(self):
+        drinks = Drink.query.order_by(Drink.id).all()
+        if len(drinks) == 0:
+            return {}
+        return {
+            'short': json.dumps({
+                'success': True,
+                'drinks': [drink.short() for drink in drinks]
+            }).encode('utf-8'),
+            'long': json.dumps({
+                'success': True,
+                'drinks': [drink.long() for drink in drinks]
+            }).encode('utf-8')
+        }
+
+
+menu_cache = MenuCache()
+Drink.on_bulk_change(menu_cache.invalidate)
@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Column, String, Integer, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -31,6 +32,20 @@ def db_drop_and_create_all():
     #db.drop_all()
     db.create_all()
 
+'''
+upgrade_recipe_column()
+    converts drinks stored with the old String(180) recipe column, which held
+    json.dumps() output, to the json column. On postgres the column type is
+    changed in place; sqlite keeps json as text, so existing rows already
+    read back as json and nothing needs converting.
+'''
+def upgrade_recipe_column():
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(
+            'ALTER TABLE drink ALTER COLUMN recipe TYPE jsonb '
+            'USING recipe::jsonb')
+        db.session.commit()
+
 '''
 Drink
 a persistent drink entity, extends the base SQLAlchemy Model
@@ -40,17 +55,16 @@ class Drink(db.Model):
     id = Column(Integer().with_variant(Integer, "sqlite"), primary_key=True)
     # String Title
     title = Column(String(80), unique=True)
-    # the ingredients blob - this stores a lazy json blob
+    # the ingredients, stored as native json (jsonb on postgres)
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
-    recipe =  Column(String(180), nullable=False)
+    recipe = Column(JSON().with_variant(JSONB(), 'postgresql'), nullable=False)
 
     '''
     short()
         short form representation of the Drink model
     '''
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
+        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in self.recipe]
         return {
             'id': self.id,
             'title': self.title,
@@ -65,7 +79,7 @@ class Drink(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': self.recipe
         }
 
     '''
@@ -0,0 +1,140 @@
+import threading
+import time
+import unittest
+
+from src.auth.jwks import JWKSCache, StaticJWKSProvider
+
+
+def jwks(*kids):
+    return {'keys': [{'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'n-' + kid,
+                      'e': 'AQAB'} for kid in kids]}
+
+
+class FakeProvider(StaticJWKSProvider):
+    """An in-memory key set that counts fetches, and can hold them until
+    released or fail them."""
+
+    def __init__(self, jwks):
+        super().__init__(jwks)
+        self.fetches = 0
+        self.error = None
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def fetch(self):
+        self.fetches += 1
+        self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return super().fetch()
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+    """This class represents the signing key cache test case"""
+
+    def setUp(self):
+        self.provider = FakeProvider(jwks('a'))
+        self.cache = JWKSCache(self.provider, ttl=600, stale_ttl=3600,
+                               min_refresh_interval=30)
+
+    def age(self, seconds):
+        """Make the cached keys and the last fetch seconds older."""
+        self.cache._fetched_at -= seconds
+        self.cache._attempted_at -= seconds
+
+    def wait_until(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def wait_for_fetches(self, count):
+        """Wait until count fetches have started and none is running."""
+        self.wait_until(lambda: self.provider.fetches >= count and
+                        self.cache._inflight is None)
+
+    #Test 1
+    def test_concurrent_misses_share_one_fetch(self):
+        self.provider.gate.clear()
+        keys = []
+        threads = [threading.Thread(
+            target=lambda: keys.append(self.cache.get_key('a')))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        self.wait_until(lambda: self.provider.fetches)
+        self.provider.gate.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.provider.fetches, 1)
+        self.assertEqual([key['kid'] for key in keys], ['a'] * 8)
+
+    #Test 2
+    def test_stale_keys_are_served_while_refreshing(self):
+        self.cache.get_key('a')
+        self.age(601)
+        self.provider.jwks = jwks('a', 'b')
+        self.provider.gate.clear()
+
+        # answered from memory while the refresh waits on the provider
+        self.assertEqual(self.cache.get_key('a')['kid'], 'a')
+        self.assertEqual(self.cache.get_key('a')['kid'], 'a')
+        self.provider.gate.set()
+        self.wait_for_fetches(2)
+
+        self.assertEqual(self.provider.fetches, 2)
+        self.assertEqual(self.cache.get_key('b')['kid'], 'b')
+
+    #Test 3
+    def test_failed_background_refresh_is_not_retried_per_request(self):
+        self.cache.get_key('a')
+        self.age(601)
+        self.provider.error = OSError('identity provider down')
+
+        self.cache.get_key('a')
+        self.wait_for_fetches(2)
+        for _ in range(5):
+            self.assertEqual(self.cache.get_key('a')['kid'], 'a')
+        self.wait_for_fetches(2)
+
+        self.assertEqual(self.provider.fetches, 2)
+
+    #Test 4
+    def test_unknown_kids_refresh_at_most_once_per_interval(self):
+        self.cache.get_key('a')
+        for _ in range(5):
+            self.assertIsNone(self.cache.get_key('bogus'))
+        self.assertEqual(self.provider.fetches, 1)
+
+        # a rotated key is picked up once the interval has passed
+        self.provider.jwks = jwks('a', 'rotated')
+        self.age(31)
+        self.assertEqual(self.cache.get_key('rotated')['kid'], 'rotated')
+        self.assertIsNone(self.cache.get_key('bogus'))
+        self.assertEqual(self.provider.fetches, 2)
+
+    #Test 5
+    def test_expired_keys_are_refreshed_before_use(self):
+        self.cache.get_key('a')
+        self.age(600 + 3600)
+        self.provider.jwks = jwks('b')
+
+        self.assertIsNone(self.cache.get_key('a'))
+        self.assertEqual(self.cache.get_key('b')['kid'], 'b')
+        self.assertEqual(self.provider.fetches, 2)
+
+    #Test 6
+    def test_expired_keys_are_kept_while_the_provider_is_down(self):
+        self.cache.get_key('a')
+        self.age(600 + 3600)
+        self.provider.error = OSError('identity provider down')
+
+        for _ in range(5):
+            self.assertEqual(self.cache.get_key('a')['kid'], 'a')
+        self.assertEqual(self.provider.fetches, 2)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()